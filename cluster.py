@@ -1,54 +1,182 @@
-from neo4j import GraphDatabase
+import argparse
 import logging
-from models.citation_extractor import LegalCitationPipeline
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import yaml
+from models.citation_extractor import extract_citations, init_ner_worker
 from neo4j_package.article_match import ArticleMatcher
+from neo4j_package.checkpoint import Checkpoint
+from neo4j_package.driver import get_session
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# contenuto nodes fetched per keyset page
+PAGE_SIZE = 500
+# Pages waiting between two stages before the one feeding them blocks
+QUEUE_PAGES = 8
+# RELATED edges per write transaction
+WRITE_BATCH_SIZE = 2000
+# Seconds between two progress reports
+REPORT_EVERY = 30
+# Seconds a blocked queue put waits before checking whether to stop
+PUT_TIMEOUT = 0.5
 
-def cluster(neo4j_config):
-    driver = GraphDatabase.driver(
-        neo4j_config['url'],
-        database=neo4j_config['database'],
-        auth=(neo4j_config['user'], neo4j_config['password'])
-    )
+_PIPELINE_DONE = object()
 
-    pipeline = LegalCitationPipeline()
+
+def _put(target_queue, item, stop):
+    """Put `item` on `target_queue` unless `stop` is set first; returns whether it was put."""
+    while not stop.is_set():
+        try:
+            target_queue.put(item, timeout=PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+class ClusterMetrics:
+    """Counters updated by the cluster stages, reported as throughput and backlog."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.pages_read = 0
+        self.nodes_read = 0
+        self.nodes_processed = 0
+        self.citations = 0
+        self.edges_written = 0
+        self.ner_seconds = 0.0
+        self._last_report = self.started
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def report(self, **backlog):
+        with self._lock:
+            elapsed = time.perf_counter() - self.started
+            return {
+                'pages_read': self.pages_read,
+                'nodes_read': self.nodes_read,
+                'nodes_processed': self.nodes_processed,
+                'citations': self.citations,
+                'edges_written': self.edges_written,
+                'nodes_per_second': round(self.nodes_processed / elapsed, 1) if elapsed else 0.0,
+                'edges_per_second': round(self.edges_written / elapsed, 1) if elapsed else 0.0,
+                'ner_seconds': round(self.ner_seconds, 1),
+                'elapsed_seconds': round(elapsed, 1),
+                'backlog': backlog
+            }
+
+    def maybe_log(self, **backlog):
+        now = time.perf_counter()
+        if now - self._last_report >= REPORT_EVERY:
+            self._last_report = now
+            logger.info(f"Clustering progress: {self.report(**backlog)}")
+
+
+def cluster(neo4j_config, resume=False, retry_failed=False, workers=None,
+            page_size=PAGE_SIZE, write_batch_size=WRITE_BATCH_SIZE):
+    """
+    Link contenuto nodes to the articles they cite, as a streaming pipeline:
+    a reader thread fetches nodes in kb_id order, one keyset page per short
+    read transaction; a pool of `workers` processes runs the citation NER
+    model over each page; citations are resolved against the in-memory
+    ArticleMatcher index; and a writer thread MERGEs the RELATED edges of
+    several pages per transaction. Stages are connected by bounded queues.
+    The last kb_id written is checkpointed, so with `resume` an interrupted
+    run continues after it; with `retry_failed` only the nodes that failed
+    last time are processed.
+    """
     matcher = ArticleMatcher(neo4j_config)
+    matcher.refresh()
+    checkpoint = Checkpoint('cluster', resume=resume or retry_failed)
+    metrics = ClusterMetrics()
 
-    with driver.session() as session:
-        logger.info("Starting clustering process...")
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 2) - 1)
 
-        # Fetch all contenuto nodes
-        result = session.run("""
-            MATCH (n:contenuto)
-            RETURN n.elementId AS id, n.contenuto AS content
-        """)
+    if retry_failed:
+        after, kb_ids = None, sorted(checkpoint.failures)
+    else:
+        after, kb_ids = checkpoint.get('last_kb_id'), None
 
-        relations_created = 0
+    logger.info("Starting clustering process...")
 
-        for record in result:
-            node_id = record["id"]
-            content = record["content"]
+    # Workers are spawned rather than forked: a fork taken while the reader
+    # and writer threads hold Neo4j driver locks can deadlock the children.
+    # Each runs torch on one thread. A single worker runs the model in this
+    # process instead of loading a second copy.
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=init_ner_worker)
+    else:
+        pool = ThreadPoolExecutor(max_workers=1)
 
-            if content:
-                citations = pipeline.process_text(content)
-                print('\ncitations: ',citations)
+    page_queue = queue.Queue(maxsize=QUEUE_PAGES)
+    write_queue = queue.Queue(maxsize=QUEUE_PAGES)
+    read_errors = []
+    stop_reading = threading.Event()
+    reader_thread = threading.Thread(
+        target=_reader_stage,
+        args=(page_queue, neo4j_config, page_size, after, kb_ids, metrics, read_errors, stop_reading),
+        daemon=True)
+    writer_thread = threading.Thread(
+        target=_writer_stage,
+        args=(write_queue, matcher, checkpoint, metrics, retry_failed, write_batch_size),
+        daemon=True)
+    reader_thread.start()
+    writer_thread.start()
 
-                for doc_name, article_number in citations:
-                    matched_doc, matched_article_id = matcher.find_best_match(
-                        doc_name, article_number)
-                    print('\ndoc: ',matched_doc)
-                    print('\nart: ',matched_article_id)
-                    if matched_article_id:
-                        matcher.create_related_relationship(
-                            node_id, matched_article_id)
-                        relations_created += 1
+    # Pages handed to the pool, collected in submission order to keep kb_id order
+    in_flight = deque()
 
-        logger.info(
-            f"Clustering completed. {relations_created} RELATED relationships created based on article citations.")
+    def backlog():
+        return {'read_queue': page_queue.qsize(), 'ner_in_flight': len(in_flight),
+                'write_queue': write_queue.qsize()}
+
+    try:
+        with pool:
+            while True:
+                page = page_queue.get()
+                if page is _PIPELINE_DONE:
+                    break
+                in_flight.append((page, pool.submit(
+                    extract_citations, [record['content'] for record in page])))
+                # Two pages per worker keep the pool busy while the oldest is collected
+                if len(in_flight) >= 2 * workers:
+                    write_queue.put(_resolve_page(matcher, checkpoint, metrics, *in_flight.popleft()))
+                metrics.maybe_log(**backlog())
+            while in_flight:
+                write_queue.put(_resolve_page(matcher, checkpoint, metrics, *in_flight.popleft()))
+    finally:
+        # If the loop above failed nothing reads page_queue any more: stop the
+        # reader and drain the queue so a put it is blocked in returns
+        stop_reading.set()
+        while reader_thread.is_alive() or not page_queue.empty():
+            try:
+                page_queue.get(timeout=PUT_TIMEOUT)
+            except queue.Empty:
+                pass
+        reader_thread.join()
+        write_queue.put(_PIPELINE_DONE)
+        writer_thread.join()
+
+    if read_errors:
+        # The checkpoint is kept so the run can be resumed
+        raise read_errors[0]
 
+    logger.info(f"Clustering completed: {metrics.report(**backlog())}")
+
+    with get_session(neo4j_config) as session:
         result = session.run("""
             MATCH ()-[r:RELATED]-()
             RETURN count(r) as total_relationships
@@ -57,16 +185,136 @@ def cluster(neo4j_config):
         logger.info(
             f"Total RELATED relationships in the database: {total_relationships}")
 
-    driver.close()
     matcher.close()
+    checkpoint.finish(metrics.nodes_processed)
+
+
+def _reader_stage(page_queue, neo4j_config, page_size, after, kb_ids, metrics, read_errors, stop):
+    """
+    Fetch contenuto nodes after `after` in kb_id order, restricted to `kb_ids`
+    when given, until done or `stop` is set. Nodes without a kb_id cannot be
+    paged by it and are skipped.
+    """
+    try:
+        with get_session(neo4j_config) as session:
+            skipped = session.run("""
+                MATCH (n:contenuto)
+                WHERE n.kb_id IS NULL
+                RETURN count(n) AS skipped
+                """).single()['skipped']
+        if skipped:
+            logger.warning(f"Skipping {skipped} contenuto nodes without a kb_id; reload their KB files to cluster them")
+
+        while not stop.is_set():
+            with get_session(neo4j_config) as session:
+                page = session.run("""
+                    MATCH (n:contenuto)
+                    WHERE n.kb_id IS NOT NULL
+                    AND ($after IS NULL OR n.kb_id > $after)
+                    AND ($kb_ids IS NULL OR n.kb_id IN $kb_ids)
+                    RETURN elementId(n) AS id, n.kb_id AS kb_id, n.contenuto AS content
+                    ORDER BY n.kb_id
+                    LIMIT $page_size
+                    """, after=after, kb_ids=kb_ids, page_size=page_size).data()
+            if not page:
+                break
+            last_kb_id = page[-1]['kb_id']
+            if after is not None and not last_kb_id > after:
+                # Never page over the same nodes twice
+                raise RuntimeError(f"kb_id did not advance past {after}")
+            if not _put(page_queue, page, stop):
+                break
+            metrics.add(pages_read=1, nodes_read=len(page))
+            after = last_kb_id
+            if len(page) < page_size:
+                break
+    except Exception as e:
+        logger.error(f"Error reading contenuto nodes after {after}: {str(e)}")
+        read_errors.append(e)
+    finally:
+        _put(page_queue, _PIPELINE_DONE, stop)
+
+
+def _resolve_page(matcher, checkpoint, metrics, page, future):
+    """
+    Wait for the citations of `page` and resolve them to RELATED edges.
+    Returns (kb_ids, edges, ok) for the writer; edges are (kb_id, source_id,
+    target_id) and ok is False when the page could not be processed.
+    """
+    kb_ids = [record['kb_id'] for record in page]
+    try:
+        citations_per_node, seconds = future.result()
+        cited = [(record, citation) for record, citations in zip(page, citations_per_node)
+                 for citation in citations]
+        matches = matcher.resolve_many([citation for _, citation in cited])
+    except Exception as e:
+        checkpoint.record_failures(kb_ids, e)
+        return kb_ids, [], False
+
+    edges = [(record['kb_id'], record['id'], matched_article_id)
+             for (record, _), (_, matched_article_id) in zip(cited, matches)
+             if matched_article_id]
+    metrics.add(nodes_processed=len(page), citations=len(cited), ner_seconds=seconds)
+    return kb_ids, edges, True
+
+
+def _writer_stage(write_queue, matcher, checkpoint, metrics, retry_failed, batch_size):
+    done = False
+    while not done:
+        item = write_queue.get()
+        if item is _PIPELINE_DONE:
+            break
+
+        # Pages queued behind this one share its transaction, up to batch_size edges
+        pages = [item]
+        total_edges = len(item[1])
+        while total_edges < batch_size:
+            try:
+                item = write_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _PIPELINE_DONE:
+                done = True
+                break
+            pages.append(item)
+            total_edges += len(item[1])
+
+        edges = [edge for _, page_edges, _ in pages for edge in page_edges]
+        failed = set()
+        try:
+            written = matcher.create_related_many(
+                [(source_id, target_id) for _, source_id, target_id in edges], batch_size)
+            metrics.add(edges_written=written)
+        except Exception as e:
+            failed = {kb_id for kb_id, _, _ in edges}
+            checkpoint.record_failures(sorted(failed), e)
+
+        if retry_failed:
+            checkpoint.mark_done_many(kb_id for kb_ids, _, ok in pages if ok
+                                      for kb_id in kb_ids if kb_id not in failed)
+        else:
+            checkpoint.set('last_kb_id', pages[-1][0][-1])
 
 
 if __name__ == "__main__":
-    neo4j_config = {
-        'url': 'neo4j+ssc://bc1e22a5.databases.neo4j.io',
-        'database': 'neo4j',
-        'user': 'neo4j',
-        'password': '-'
-    }
-
-    cluster(neo4j_config)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', type=str, default='config.yaml',
+                        help='Path to config file')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted run from its checkpoint')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='Only process the nodes that failed in the last run')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Processes running the citation NER model (default: CPU count - 1)')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE,
+                        help='contenuto nodes fetched per read')
+    parser.add_argument('--write-batch-size', type=int, default=WRITE_BATCH_SIZE,
+                        help='RELATED edges per write transaction')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        neo4j_config = yaml.safe_load(f)['neo4j_config']
+
+    cluster(neo4j_config, resume=args.resume, retry_failed=args.retry_failed,
+            workers=args.workers, page_size=args.page_size,
+            write_batch_size=args.write_batch_size)
@@ -1,323 +1,765 @@
-from neo4j import GraphDatabase
-from models.chunker import Chunker
+import argparse
+import contextlib
+import csv
 import os
 import glob
+import hashlib
 import logging
+import multiprocessing
 import uuid
 import json
-from models.chunker import Embedder
-from models.citation_extractor import LegalCitationPipeline
+import yaml
+import itertools
+import queue
+from collections import defaultdict
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from tqdm import tqdm
+from models.chunker import prepare_document
+from models.entity_extractor import infer_doc_type, labels_for
+from models.registry import configure, get_chunker, get_citation_pipeline, get_embedder
 from neo4j_package.article_match import ArticleMatcher
+from neo4j_package.bulk import batched, run_unwind, vector_param
+from neo4j_package.checkpoint import Checkpoint
+from neo4j_package.driver import get_session
+from neo4j_package.manifest import file_hash, settings_fingerprint, load_manifest, is_current, record_ingest
 
 
-legal_embedder = Embedder(legal=True) 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-chunker = Chunker.get_instance()
+# Rows per UNWIND statement when writing chunks and entities
+WRITE_BATCH_SIZE = 500
+# Chunks handed to the entity and embedding models in one go by load_docs
+MODEL_BATCH_CHUNKS = 256
+# Documents buffered between the stages of the load_docs pipeline
+PIPELINE_QUEUE_SIZE = 8
 
+_PIPELINE_DONE = object()
 
-def ingest_document_d(doc_location, neo4j_config):
-    return _ingest_document(doc_location, neo4j_config, tag='d')
+DOCS_MANIFEST_KIND = 'docs'
+KB_MANIFEST_KIND = 'kb'
+# Bump when create_kb_nodes changes the shape of the law graph
+KB_LOADER_VERSION = 2
+# Texts per forward pass when embedding law nodes
+EMBED_BATCH_SIZE = 64
+# jsonl lines per citation extraction and write batch in related_intentional
+RELATED_BATCH_SIZE = 64
+# Rows per UNWIND statement when loading KB law nodes
+KB_BATCH_SIZE = 2000
 
 
-def _ingest_document(doc_location, neo4j_config, tag):
-    driver = GraphDatabase.driver(
-        neo4j_config['url'],
-        database=neo4j_config['database'],
-        auth=(neo4j_config['user'], neo4j_config['password'])
-    )
+def ingest_document_d(doc_location, neo4j_config, batch_size=WRITE_BATCH_SIZE, force=False):
+    return _ingest_document(doc_location, neo4j_config, tag='d', batch_size=batch_size, force=force)
 
+
+def _chunk_id(name, order, text):
+    # Deterministic, so re-ingesting the same content yields the same ids
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{name}#{order}#{text}"))
+
+
+def _prepare_chunk_rows(name, chunks, order=0, previous_chunk_id=None):
+    """
+    Turn chunker output into UNWIND rows for Chunk nodes, NEXT links and
+    HAS_ENTITY edges. Invalid chunks are dropped so the NEXT chain stays intact.
+    `order` and `previous_chunk_id` continue the chain from an earlier batch.
+    """
+    chunk_rows, next_rows, entity_rows = [], [], []
+
+    for i, chunk in enumerate(chunks):
+        chunk_text = chunk['text']
+        chunk_embedding = chunk['embedding']
+
+        if not chunk_text or chunk_embedding is None or len(chunk_embedding) == 0:
+            logger.warning(
+                f"Invalid chunk {order + i} found in document {name}. Skipping.")
+            continue
+
+        chunk_order = order + len(chunk_rows)
+        unique_chunk_id = _chunk_id(name, chunk_order, chunk_text)
+        chunk_rows.append({
+            'chunk_id': unique_chunk_id,
+            'text': chunk_text,
+            'embedding': vector_param(chunk_embedding),
+            'order': chunk_order,
+            'page_start': chunk.get('page_start'),
+            'page_end': chunk.get('page_end')
+        })
+        if previous_chunk_id is not None:
+            next_rows.append({'prev_id': previous_chunk_id,
+                              'chunk_id': unique_chunk_id})
+        previous_chunk_id = unique_chunk_id
+
+        for entity in chunk['entities']:
+            entity_rows.append({
+                'chunk_id': unique_chunk_id,
+                'text': entity['text'],
+                'label': entity['label']
+            })
+
+    return chunk_rows, next_rows, entity_rows
+
+
+def _replace_document(tx, name, tag):
+    # Replace any previous version of the document inside the same transaction
+    tx.run("""
+        MATCH (d:Document {name: $name})-[:NEXT*]->(c:Chunk)
+        WITH DISTINCT c
+        DETACH DELETE c
+        """, name=name).consume()
+
+    tx.run(
+        "MERGE (d:Document {name: $name}) SET d.tag = $tag",
+        name=name, tag=tag
+    ).consume()
+
+
+def _write_chunks(tx, name, chunk_rows, next_rows, entity_rows, batch_size=WRITE_BATCH_SIZE):
+    run_unwind(tx, """
+        UNWIND $rows AS row
+        CREATE (c:Chunk {text: row.text, chunk_id: row.chunk_id, order: row.order})
+        SET c.embedding = row.embedding,
+            c.page_start = row.page_start,
+            c.page_end = row.page_end
+        """, chunk_rows, batch_size)
+
+    if chunk_rows and chunk_rows[0]['order'] == 0:
+        tx.run("""
+            MATCH (d:Document {name: $doc_name})
+            MATCH (c:Chunk {chunk_id: $chunk_id})
+            CREATE (d)-[:NEXT]->(c)
+            """, doc_name=name, chunk_id=chunk_rows[0]['chunk_id']).consume()
+
+    run_unwind(tx, """
+        UNWIND $rows AS row
+        MATCH (prev:Chunk {chunk_id: row.prev_id})
+        MATCH (c:Chunk {chunk_id: row.chunk_id})
+        CREATE (prev)-[:NEXT]->(c)
+        """, next_rows, batch_size)
+
+    run_unwind(tx, """
+        UNWIND $rows AS row
+        MATCH (c:Chunk {chunk_id: row.chunk_id})
+        MERGE (e:Entity {text: row.text, label: row.label})
+        MERGE (c)-[:HAS_ENTITY]->(e)
+        """, entity_rows, batch_size)
+
+
+def _known_chunks(session, name):
+    """Previously stored chunks of a document, keyed by text, for reuse on re-ingestion."""
+    result = session.run("""
+        MATCH (d:Document {name: $name})-[:NEXT*]->(c:Chunk)
+        WITH DISTINCT c
+        OPTIONAL MATCH (c)-[:HAS_ENTITY]->(e:Entity)
+        RETURN c.text AS text,
+               c.embedding AS embedding,
+               collect(CASE WHEN e IS NULL THEN null ELSE {text: e.text, label: e.label} END) AS entities
+        """, name=name)
+    return {
+        record['text']: {
+            'text': record['text'],
+            'embedding': record['embedding'],
+            'entities': record['entities']
+        }
+        for record in result
+    }
+
+
+def _plan_documents(neo4j_config, doc_locations, force=False):
+    """
+    Compare each file against the ingestion manifest. Returns
+    {doc_location: (content_hash, reuse)} for files that need (re)ingestion,
+    where `reuse` means stored chunks were produced with the current settings
+    and unchanged chunk texts can skip the models.
+    """
+    fingerprint = settings_fingerprint(get_chunker().settings)
+    with get_session(neo4j_config) as session:
+        manifest = load_manifest(session, DOCS_MANIFEST_KIND)
+
+    plan = {}
+    for doc_location in doc_locations:
+        content_hash = file_hash(doc_location)
+        entry = manifest.get(os.path.basename(doc_location))
+        if not force and is_current(entry, content_hash, fingerprint):
+            logger.info(f"Skipping unchanged document: {doc_location}")
+            continue
+        reuse = entry is not None and entry['fingerprint'] == fingerprint
+        plan[doc_location] = (content_hash, reuse)
+    return plan
+
+
+def _store_document(doc_location, chunks, neo4j_config, tag, batch_size=WRITE_BATCH_SIZE, content_hash=None):
+    """
+    Write a document's chunks, which may be a list or a stream from
+    `Chunker.chunk_text`; streamed chunks are written batch by batch as they
+    are produced.
+    """
+    name = os.path.basename(doc_location)
+
+    logger.info(f"Processing document: {name}")
+
+    chunk_count, entity_count = 0, 0
+    previous_chunk_id = None
+
+    # All chunks, links and entities of a document are written in one
+    # transaction so a failure never leaves a half-ingested document.
+    with get_session(neo4j_config) as session:
+        with session.begin_transaction() as tx:
+            _replace_document(tx, name, tag)
+            for batch in batched(chunks, batch_size):
+                chunk_rows, next_rows, entity_rows = _prepare_chunk_rows(
+                    name, batch, chunk_count, previous_chunk_id)
+                _write_chunks(tx, name, chunk_rows,
+                              next_rows, entity_rows, batch_size)
+                if chunk_rows:
+                    previous_chunk_id = chunk_rows[-1]['chunk_id']
+                chunk_count += len(chunk_rows)
+                entity_count += len(entity_rows)
+            if content_hash is not None:
+                record_ingest(tx, DOCS_MANIFEST_KIND, name,
+                              content_hash, get_chunker().settings)
+            tx.commit()
+
+    logger.info(
+        f"Document '{name}' ingested successfully with tag '{tag}': "
+        f"{chunk_count} chunks, {entity_count} entity links.")
+
+
+def _ingest_document(doc_location, neo4j_config, tag, batch_size=WRITE_BATCH_SIZE, force=False):
     try:
-        with driver.session() as session:
-            name = os.path.basename(doc_location)
-            chunks = chunker.chunk_text(doc_location)
-
-            logger.info(f"Processing document: {name}")
-            logger.info(f"Number of chunks: {len(chunks)}")
-            logger.info(
-                f"First chunk structure: {chunks[0] if chunks else 'No chunks'}")
-
-            # Create Document node with tag
-            session.run(
-                "MERGE (d:Document {name: $name}) SET d.tag = $tag",
-                name=name, tag=tag
-            )
-
-            previous_chunk_id = None
-            for i, chunk in enumerate(chunks):
-                try:
-                    chunk_text = chunk['text']
-                    chunk_embedding = chunk['embedding']
-                    chunk_entities = chunk['entities']
-
-                    logger.info(
-                        f"Processing chunk {i+1}/{len(chunks)} for document {name}")
-                    logger.info(f"Chunk text: {chunk_text[:100]}...")
-                    logger.info(
-                        f"Number of entities in chunk: {len(chunk_entities)}")
-
-                    if not chunk_text or not chunk_embedding:
-                        logger.warning(
-                            f"Invalid chunk found in document {name}. Skipping.")
-                        continue
-
-                    # Create Chunk node with unique chunk_id and link to Document or previous Chunk
-                    unique_chunk_id = str(uuid.uuid4())
-                    if i == 0:
-                        result = session.run(
-                            """
-                            CREATE (c:Chunk {text: $text, chunk_id: $chunk_id})
-                            SET c.embedding = $embedding
-                            WITH c
-                            MATCH (d:Document {name: $doc_name})
-                            CREATE (d)-[:NEXT]->(c)
-                            RETURN elementId(c) as neo4j_id
-                            """,
-                            doc_name=name, text=chunk_text, embedding=chunk_embedding, chunk_id=unique_chunk_id
-                        )
-                    else:
-                        result = session.run(
-                            """
-                            CREATE (c:Chunk {text: $text, chunk_id: $chunk_id})
-                            SET c.embedding = $embedding
-                            WITH c
-                            MATCH (prev:Chunk)
-                            WHERE elementId(prev) = $prev_id
-                            CREATE (prev)-[:NEXT]->(c)
-                            RETURN elementId(c) as neo4j_id
-                            """,
-                            text=chunk_text, embedding=chunk_embedding, prev_id=previous_chunk_id, chunk_id=unique_chunk_id
-                        )
-
-                    neo4j_id = result.single()["neo4j_id"]
-                    logger.info(
-                        f"Created Chunk node with ID: {neo4j_id} and unique chunk_id: {unique_chunk_id}")
-
-                    # Create Entity nodes and link them to the Chunk
-                    for entity in chunk_entities:
-                        entity_text = entity['text']
-                        entity_label = entity['label']
-
-                        session.run(
-                            """
-                            MERGE (e:Entity {text: $text, label: $label})
-                            WITH e
-                            MATCH (c:Chunk {chunk_id: $chunk_id})
-                            MERGE (c)-[:HAS_ENTITY]->(e)
-                            """,
-                            text=entity_text, label=entity_label, chunk_id=unique_chunk_id
-                        )
-
-                    logger.info(
-                        f"Processed {len(chunk_entities)} entities for chunk {i+1}")
-                    previous_chunk_id = neo4j_id
+        plan = _plan_documents(neo4j_config, [doc_location], force)
+        if doc_location not in plan:
+            return
+        content_hash, reuse = plan[doc_location]
 
-                except Exception as e:
-                    logger.error(
-                        f"Error processing chunk {i} of document {name}: {str(e)}")
+        known_chunks = None
+        if reuse:
+            with get_session(neo4j_config) as session:
+                known_chunks = _known_chunks(
+                    session, os.path.basename(doc_location))
 
-            logger.info(f"Document '{name}' ingestion completed.")
+        chunks = get_chunker().chunk_text(doc_location, known_chunks)
+        _store_document(doc_location, chunks, neo4j_config,
+                        tag, batch_size, content_hash)
 
     except Exception as e:
         logger.error(f"Error ingesting document {doc_location}: {str(e)}")
 
-    finally:
-        driver.close()
 
-    logger.info(f"Document '{name}' ingested successfully with tag '{tag}'.")
+def _load_article_ids(session, law_name):
+    """Map 'Art. N' titles of the leaf articles of `law_name` to their element ids."""
+    result = session.run("""
+        MATCH (d:Document)-[:HAS*]->(c:contenuto)
+        WHERE toLower(d.nome_legge) = toLower($law_name)
+        AND NOT (c)-[:HAS]->()
+        RETURN c.titolo AS titolo, elementId(c) AS id
+        """, law_name=law_name)
+    article_ids = {}
+    for record in result:
+        article_ids.setdefault(record['titolo'], record['id'])
+    return article_ids
+
+
+def _related_rows(lines, source_ids, pipeline, matcher):
+    """Parse a batch of jsonl lines and return the RELATED edge rows they produce."""
+    items = []
+    for line in lines:
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            logger.error(f"Error parsing JSON line: {e}")
+            continue
+
+        article_number = data.get('article_number')
+        text_content = data.get('text')
+        if not article_number or not text_content:
+            continue
+
+        article_title = f"Art. {article_number}"
+        source_id = source_ids.get(article_title)
+        if not source_id:
+            logger.warning(f"No matching node found for article {article_title}")
+            continue
+        items.append((source_id, text_content))
+
+    cited = []
+    citations_batch = pipeline.process_batch([text for _, text in items])
+    for (source_id, text_content), citations in zip(items, citations_batch):
+        for citation in citations:
+            cited.append((source_id, text_content, citation))
+
+    # Every citation of the batch is resolved in one call
+    rows = []
+    matches = matcher.resolve_many([citation for _, _, citation in cited])
+    for (source_id, text_content, _), (_, matched_article_id) in zip(cited, matches):
+        if matched_article_id:
+            rows.append({'source_id': source_id,
+                         'target_id': matched_article_id,
+                         'text': text_content})
+    return rows
 
-def related_intentional(neo4j_config):
-    driver = GraphDatabase.driver(
-        neo4j_config['url'],
-        database=neo4j_config['database'],
-        auth=(neo4j_config['user'], neo4j_config['password'])
-    )
 
-    pipeline = LegalCitationPipeline()
+def related_intentional(neo4j_config, batch_size=RELATED_BATCH_SIZE, resume=False, retry_failed=False):
+    """
+    Stream the commentaries in data/related in batches: citations are
+    extracted for a whole batch at once, sources are resolved against a
+    preloaded table of Codice Civile articles, and the resulting RELATED edges
+    are written with one UNWIND per batch. Progress is checkpointed per file
+    and line, so with `resume` an interrupted run picks up where it stopped.
+    Batches that fail are recorded as 'file:start-end' line ranges and can be
+    reprocessed on their own with `retry_failed`.
+    """
+    pipeline = get_citation_pipeline()
     matcher = ArticleMatcher(neo4j_config)
-    
-    related_dir = "data/related"
-    jsonl_files = glob.glob(os.path.join(related_dir, '*.jsonl'))
-    
-    logger.info(f"Found {len(jsonl_files)} .jsonl files to process")
-    
-    with driver.session() as session:
-        for jsonl_file in jsonl_files:
-            logger.info(f"Processing file: {jsonl_file}")
-            
+    checkpoint = Checkpoint('related_intentional', resume=resume or retry_failed)
+
+    def write_batch(session, jsonl_file, start, lines):
+        item = f"{jsonl_file}:{start}-{start + len(lines)}"
+        try:
+            rows = _related_rows(lines, source_ids, pipeline, matcher)
+            run_unwind(session, """
+                UNWIND $rows AS row
+                MATCH (source) WHERE elementId(source) = row.source_id
+                MATCH (target) WHERE elementId(target) = row.target_id
+                MERGE (source)-[r:RELATED]->(target)
+                SET r.text = row.text
+                """, rows)
+            if retry_failed:
+                checkpoint.mark_done(item)
+            return len(rows)
+        except Exception as e:
+            checkpoint.record_failure(item, e)
+            return 0
+
+    if retry_failed:
+        work = []
+        for item in checkpoint.failures:
+            jsonl_file, line_range = item.rsplit(':', 1)
+            start, end = (int(n) for n in line_range.split('-'))
+            work.append((jsonl_file, start, end))
+    else:
+        related_dir = "data/related"
+        work = [(jsonl_file, None, None) for jsonl_file in
+                sorted(glob.glob(os.path.join(related_dir, '*.jsonl')))]
+
+    logger.info(f"Found {len(work)} .jsonl files or ranges to process")
+
+    relations = 0
+    processed = 0
+    with get_session(neo4j_config) as session:
+        source_ids = _load_article_ids(session, 'Codice Civile')
+        logger.info(f"Loaded {len(source_ids)} Codice Civile articles")
+
+        for jsonl_file, start, end in work:
+            offsets = checkpoint.get('offsets', {})
+            offset = start if start is not None else offsets.get(jsonl_file, 0)
+            if offset < 0:
+                logger.info(f"Skipping completed file: {jsonl_file}")
+                continue
+
+            logger.info(f"Processing file: {jsonl_file} from line {offset}")
             with open(jsonl_file, 'r', encoding='utf-8') as file:
-                for line in file:
-                    try:
-                        data = json.loads(line)
-                        article_number = data.get('article_number')
-                        text_content = data.get('text')
-                        
-                        if not article_number or not text_content:
-                            continue
-                        
-                        article_title = f"Art. {article_number}"
-                        
-                        # Find the corresponding contenuto node
-                        result = session.run("""
-                            MATCH (d:Document)-[:HAS*]->(c:contenuto)
-                            WHERE d.nome_legge = 'Codice Civile' 
-                            AND c.titolo = $article_title
-                            AND NOT (c)-[:HAS]->()
-                            RETURN elementId(c) as source_id
-                        """, article_title=article_title)
-                        
-                        record = result.single()
-                        if not record:
-                            logger.warning(f"No matching node found for article {article_title}")
-                            continue
-                            
-                        source_id = record["source_id"]
-                        
-                        # Process text content to find citations
-                        citations = pipeline.process_text(text_content)
-                        
-                        for doc_name, cited_article_number in citations:
-                            matched_doc, matched_article_id = matcher.find_best_match(
-                                doc_name, cited_article_number)
-                            
-                            if matched_article_id:
-                                session.run("""
-                                    MATCH (source), (target)
-                                    WHERE elementId(source) = $source_id 
-                                    AND elementId(target) = $target_id
-                                    MERGE (source)-[r:RELATED]->(target)
-                                    SET r.text = $text_content
-                                """, 
-                                    source_id=source_id, 
-                                    target_id=matched_article_id,
-                                    text_content=text_content
-                                )
-                                
-                                logger.info(f"Created RELATED relationship with text content: {article_title} -> {cited_article_number}")
-                    
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Error parsing JSON line: {e}")
-                    except Exception as e:
-                        logger.error(f"Error processing line: {e}")
-    
-    driver.close()
-    logger.info("Completed processing intentional relations from .jsonl files")
-
-
-
-def process_contenuto_nodes(neo4j_config):
-    driver = GraphDatabase.driver(
-        neo4j_config['url'],
-        database=neo4j_config['database'],
-        auth=(neo4j_config['user'], neo4j_config['password'])
-    )
-
-    with driver.session() as session:
-        # Process all nodes with 'rubrica' field
-        result = session.run("""
+                lines = tqdm(itertools.islice(file, offset, end),
+                             desc=os.path.basename(jsonl_file), initial=offset)
+                for batch in batched(lines, batch_size):
+                    relations += write_batch(session, jsonl_file, offset, batch)
+                    processed += len(batch)
+
+                    offset += len(batch)
+                    if start is None:
+                        offsets[jsonl_file] = offset
+                        checkpoint.set('offsets', offsets)
+
+            if start is None:
+                offsets[jsonl_file] = -1
+                checkpoint.set('offsets', offsets)
+
+    logger.info(
+        f"Completed processing intentional relations from .jsonl files: {relations} RELATED relationships written")
+    logger.info(f"Citation extraction: {pipeline.stats()}")
+    checkpoint.finish(processed)
+
+
+def _embedding_hash(text, model_name):
+    return hashlib.sha256(f"{model_name}\0{text}".encode('utf-8')).hexdigest()
+
+
+def _stale_embedding_rows(session, query, model_name, force=False):
+    """Rows of nodes returned by `query` whose embedding is missing or out of date."""
+    rows = []
+    for record in session.run(query):
+        text = record['text']
+        if not text:
+            continue
+        text_hash = _embedding_hash(text, model_name)
+        if force or record['embedding_hash'] != text_hash or not record['has_embedding']:
+            rows.append({'id': record['id'], 'text': text, 'hash': text_hash})
+    return rows
+
+
+def process_contenuto_nodes(neo4j_config, batch_size=EMBED_BATCH_SIZE, force=False, resume=False, retry_failed=False):
+    """
+    Embed law nodes that have no embedding yet or whose text or embedding
+    model changed since they were embedded, in batches, writing the vectors
+    back with one UNWIND per batch. Nodes embedded by an interrupted run are
+    already up to date, so rerunning resumes naturally; the checkpoint keeps
+    the last node id written and the ids of failed batches for `retry_failed`.
+    """
+    # The version of the model that actually embeds, which in server mode is the server's
+    model_name = get_embedder(legal=True).model_embedder.model_version
+    checkpoint = Checkpoint('process_contenuto_nodes', resume=resume or retry_failed)
+
+    with get_session(neo4j_config) as session:
+        # contenuto nodes embed their text, or their rubrica when they have none
+        rows = _stale_embedding_rows(session, """
         MATCH (n:contenuto)
-        RETURN elementId(n) as id, 
-               n.rubrica as rubrica,
-               n.contenuto as contenuto
-        """)
-
-        for record in result:
-            node_id = record['id']
-            rubrica = record['rubrica']
-            contenuto = record['contenuto']
-            
-            # If contenuto exists, use it for embedding, otherwise use rubrica
-            text_to_embed = contenuto if contenuto is not None else rubrica
-            embedding = legal_embedder.get_embedding(text_to_embed)
-            
-            session.run("""
-            MATCH (n)
-            WHERE elementId(n) = $node_id
-            SET n.embedding = $embedding
-            """, node_id=node_id, embedding=embedding)
-
-        # Process parti nodes
-        result = session.run("""
+        RETURN elementId(n) AS id,
+               coalesce(n.contenuto, n.rubrica) AS text,
+               n.embedding_hash AS embedding_hash,
+               n.embedding IS NOT NULL AS has_embedding
+        """, model_name, force)
+
+        rows += _stale_embedding_rows(session, """
         MATCH (n:parti)
         WHERE n.rubrica IS NOT NULL
-        RETURN elementId(n) as id, n.rubrica as content
-        """)
-
-        for record in result:
-            node_id = record['id']
-            content = record['content']
-            
-            embedding = legal_embedder.get_embedding(content)
-            
-            session.run("""
-            MATCH (c:contenuto)
-            WHERE elementId(c) = $node_id
-            SET c.embedding = $embedding
-            """, node_id=node_id, embedding=embedding)
-
-    driver.close()
+        RETURN elementId(n) AS id,
+               n.rubrica AS text,
+               n.embedding_hash AS embedding_hash,
+               n.embedding IS NOT NULL AS has_embedding
+        """, model_name, force)
+
+        if retry_failed:
+            failed = checkpoint.failures
+            rows = [row for row in rows if row['id'] in failed]
+
+        logger.info(f"{len(rows)} law nodes need a new embedding")
+
+        embedded = 0
+        for batch in batched(rows, batch_size):
+            try:
+                embeddings = get_embedder(legal=True).get_embeddings(
+                    [row['text'] for row in batch])
+                run_unwind(session, """
+                UNWIND $rows AS row
+                MATCH (n)
+                WHERE elementId(n) = row.id
+                SET n.embedding = row.embedding,
+                    n.embedding_hash = row.hash
+                """, [{'id': row['id'], 'hash': row['hash'], 'embedding': vector_param(embedding)}
+                      for row, embedding in zip(batch, embeddings)])
+            except Exception as e:
+                checkpoint.record_failures([row['id'] for row in batch], e)
+                continue
+
+            if retry_failed:
+                checkpoint.mark_done_many(row['id'] for row in batch)
+            checkpoint.set('last_id', batch[-1]['id'])
+            embedded += len(batch)
+            logger.info(f"Embedded {embedded}/{len(rows)} law nodes")
+
     logger.info("Processed nodes with embeddings.")
+    if rows:
+        logger.info(f"Embedding cache: {get_embedder(legal=True).cache_stats()}")
+    checkpoint.finish(len(rows))
 
 
-def load_docs(neo4j_config):
-    file_location = "data/docs"
-    pdf_files = glob.glob(os.path.join(file_location, '*.pdf'))
+def _model_stage(parsed_queue, enriched_queue, checkpoint, plan, neo4j_config, max_chunks=MODEL_BATCH_CHUNKS):
+    """
+    Pull split documents, run entity extraction and embedding over the chunks
+    of several documents at once, and hand each finished document to the writer.
+    """
+    try:
+        done = False
+        while not done:
+            item = parsed_queue.get()
+            if item is _PIPELINE_DONE:
+                break
+
+            documents = [item]
+            total_chunks = len(item[1])
+            while total_chunks < max_chunks:
+                try:
+                    item = parsed_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _PIPELINE_DONE:
+                    done = True
+                    break
+                documents.append(item)
+                total_chunks += len(item[1])
+
+            try:
+                known_chunks = {}
+                reused = [doc_location for doc_location, _ in documents
+                          if plan[doc_location][1]]
+                if reused:
+                    with get_session(neo4j_config) as session:
+                        for doc_location in reused:
+                            known_chunks.update(_known_chunks(
+                                session, os.path.basename(doc_location)))
+
+                # Documents sharing an entity label set are enriched together
+                by_type = defaultdict(list)
+                for doc_location, texts in documents:
+                    by_type[infer_doc_type(doc_location)].append(
+                        (doc_location, texts))
+
+                enriched = []
+                for doc_type, group in by_type.items():
+                    all_texts = [chunk for _, texts in group for chunk in texts]
+                    all_chunks = get_chunker().enrich_chunks(
+                        all_texts, known_chunks, labels_for(doc_type))
+
+                    offset = 0
+                    for doc_location, texts in group:
+                        enriched.append(
+                            (doc_location, all_chunks[offset:offset + len(texts)]))
+                        offset += len(texts)
+            except Exception as e:
+                for doc_location, _ in documents:
+                    checkpoint.record_failure(doc_location, e)
+                continue
+
+            for item in enriched:
+                enriched_queue.put(item)
+    finally:
+        enriched_queue.put(_PIPELINE_DONE)
+
+
+def _writer_stage(enriched_queue, neo4j_config, tag, batch_size, checkpoint, plan):
+    while True:
+        item = enriched_queue.get()
+        if item is _PIPELINE_DONE:
+            break
+
+        doc_location, chunks = item
+        try:
+            _store_document(doc_location, chunks, neo4j_config,
+                            tag, batch_size, plan[doc_location][0])
+            checkpoint.mark_done(doc_location)
+        except Exception as e:
+            checkpoint.record_failure(doc_location, e)
+
+
+def load_docs(neo4j_config, batch_size=WRITE_BATCH_SIZE, workers=None, queue_size=PIPELINE_QUEUE_SIZE, force=False,
+              resume=False, retry_failed=False):
+    """
+    Ingest every PDF in data/docs through a three stage pipeline: a process
+    pool reads and splits documents, a model stage extracts entities and
+    embeddings, and a single writer commits one document per transaction.
+    Stages are connected by bounded queues so memory stays flat.
+    Files unchanged since their last ingestion are skipped unless `force`.
+    With `resume`, documents completed by an interrupted run are skipped;
+    with `retry_failed`, only the documents that failed last time are processed.
+    """
+    checkpoint = Checkpoint('load_docs', resume=resume or retry_failed)
+
+    if retry_failed:
+        pdf_files = sorted(checkpoint.failures)
+    else:
+        file_location = "data/docs"
+        pdf_files = glob.glob(os.path.join(file_location, '*.pdf'))
+        pdf_files = [pdf_file for pdf_file in pdf_files
+                     if not checkpoint.is_done(pdf_file)]
 
     print(f'#PDF files found: {len(pdf_files)}!')
 
-    for pdf_file in pdf_files:
-        ingest_document_d(pdf_file, neo4j_config)
+    plan = _plan_documents(neo4j_config, pdf_files, force)
+    pdf_files = [pdf_file for pdf_file in pdf_files if pdf_file in plan]
+    logger.info(f"{len(pdf_files)} documents new or changed since last ingestion")
 
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 2) - 1)
 
-def create_kb_nodes(session, data, parent_node=None, parent_label=None):
-    for key, value in data.items():
-        if isinstance(value, dict):
-            if key == "Document":
-                node_query = """
-                MERGE (n:Document {nome_legge: $nome_legge})
-                RETURN n
-                """
-                result = session.run(
-                    node_query, nome_legge=value.get("nome_legge", "Unknown"))
-            else:
-                node_query = """
-                CREATE (n:{})
-                RETURN n
-                """.format(key)
-                result = session.run(node_query)
-
-            node = result.single()["n"]
-
-            for prop_key, prop_value in value.items():
-                if not isinstance(prop_value, (dict, list)):
-                    session.run(f"MATCH (n:{key}) WHERE elementId(n) = $id SET n.{prop_key} = $value",
-                                id=node.element_id, value=prop_value)
-
-            # Link to parent node if it exists
-            if parent_node and parent_label:
-                link_query = f"""
-                MATCH (parent:{parent_label}), (child:{key})
-                WHERE elementId(parent) = $parent_id AND elementId(child) = $child_id
-                CREATE (parent)-[:HAS]->(child)
-                """
-                session.run(link_query, parent_id=parent_node.element_id,
-                            child_id=node.element_id)
+    # Workers are spawned rather than forked, and before the stage threads
+    # start: a fork taken while they hold Neo4j driver locks can deadlock
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    parsed_queue = queue.Queue(maxsize=queue_size)
+    enriched_queue = queue.Queue(maxsize=queue_size)
+    model_thread = threading.Thread(
+        target=_model_stage,
+        args=(parsed_queue, enriched_queue, checkpoint, plan, neo4j_config),
+        daemon=True)
+    writer_thread = threading.Thread(
+        target=_writer_stage,
+        args=(enriched_queue, neo4j_config, 'd', batch_size, checkpoint, plan),
+        daemon=True)
+    model_thread.start()
+    writer_thread.start()
+
+    splitter_options = get_chunker().splitter_options
+    submitted = {}
+
+    def collect(futures):
+        for future in futures:
+            doc_location = submitted.pop(future)
+            try:
+                parsed_queue.put(future.result())
+            except Exception as e:
+                checkpoint.record_failure(doc_location, e)
+
+    try:
+        with pool:
+            for pdf_file in pdf_files:
+                if len(submitted) >= workers + queue_size:
+                    finished, _ = wait(
+                        submitted, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                submitted[pool.submit(
+                    prepare_document, pdf_file, splitter_options)] = pdf_file
+            collect(list(submitted))
+    finally:
+        parsed_queue.put(_PIPELINE_DONE)
+        model_thread.join()
+        writer_thread.join()
+
+    if pdf_files:
+        logger.info(f"Embedding cache: {get_chunker().embedder.cache_stats()}")
+    checkpoint.finish(len(pdf_files))
+
+
+def flatten_kb(data, source):
+    """
+    Flatten a KB JSON hierarchy into (document, nodes). `document` holds the
+    scalar properties of the root Document (or None); every other dict becomes
+    a node with its label, a client-side kb_id, its parent's kb_id and label
+    and its depth. Children of the root Document have parent_id None.
+    kb_ids are derived from `source`, so every file needs its own.
+    """
+    if not source:
+        raise ValueError("flatten_kb needs the source file name to build unique kb_ids")
 
-            # Recursively create nodes for nested dictionaries
-            for sub_key, sub_value in value.items():
-                if isinstance(sub_value, (dict, list)):
-                    create_kb_nodes(session, {sub_key: sub_value}, node, key)
+    document = None
+    nodes = []
 
-        elif isinstance(value, list):
+    def visit(key, value, parent_id, parent_label, depth):
+        nonlocal document
+        if isinstance(value, list):
             # Create nodes for list items
             for item in value:
                 if isinstance(item, dict):
-                    create_kb_nodes(
-                        session, {key: item}, parent_node, parent_label)
+                    visit(key, item, parent_id, parent_label, depth)
+            return
+        if not isinstance(value, dict):
+            return
+
+        props = {k: v for k, v in value.items()
+                 if not isinstance(v, (dict, list))}
+
+        if key == "Document" and depth == 0:
+            document = props
+            node_id, label = None, "Document"
+        else:
+            node_id, label = f"{source}#{len(nodes)}", key
+            props['kb_id'] = node_id
+            props['source'] = source
+            nodes.append({
+                'label': label,
+                'kb_id': node_id,
+                'parent_id': parent_id,
+                'parent_label': parent_label,
+                'depth': depth,
+                'props': props
+            })
+
+        # Recursively create nodes for nested dictionaries
+        for sub_key, sub_value in value.items():
+            if isinstance(sub_value, (dict, list)):
+                visit(sub_key, sub_value, node_id, label, depth + 1)
+
+    for key, value in data.items():
+        visit(key, value, None, None, 0)
+
+    return document, nodes
+
+
+def _ensure_kb_indexes(session, labels):
+    # Schema changes cannot share a transaction with the writes
+    for label in labels:
+        session.run(
+            f"CREATE INDEX {label}_kb_id_index IF NOT EXISTS FOR (n:`{label}`) ON (n.kb_id)").consume()
 
 
-def ingest_kb_structure(file_path, neo4j_config):
+def create_kb_nodes(session, data, source, batch_size=KB_BATCH_SIZE):
+    """
+    Write a KB JSON hierarchy with a handful of UNWIND statements: nodes are
+    grouped by depth, label and parent label, and each group creates its nodes
+    and HAS edges in one pass, matching parents on their indexed kb_id.
+    """
+    document, nodes = flatten_kb(data, source)
+    nome_legge = document.get("nome_legge", "Unknown") if document is not None else None
+
+    if document is not None:
+        session.run("""
+            MERGE (n:Document {nome_legge: $nome_legge})
+            SET n += $props
+            """, nome_legge=nome_legge, props=document).consume()
+
+    groups = defaultdict(list)
+    for node in nodes:
+        groups[(node['depth'], node['label'], node['parent_label'])].append(
+            {'parent_id': node['parent_id'], 'props': node['props']})
+
+    for (depth, label, parent_label), rows in sorted(groups.items(), key=lambda g: g[0][0]):
+        if parent_label is None:
+            query = f"""
+                UNWIND $rows AS row
+                CREATE (n:`{label}`)
+                SET n = row.props
+                """
+        elif parent_label == "Document" and depth == 1:
+            query = f"""
+                MATCH (parent:Document {{nome_legge: $nome_legge}})
+                UNWIND $rows AS row
+                CREATE (n:`{label}`)
+                SET n = row.props
+                CREATE (parent)-[:HAS]->(n)
+                """
+        else:
+            query = f"""
+                UNWIND $rows AS row
+                MATCH (parent:`{parent_label}` {{kb_id: row.parent_id}})
+                CREATE (n:`{label}`)
+                SET n = row.props
+                CREATE (parent)-[:HAS]->(n)
+                """
+        run_unwind(session, query, rows, batch_size, nome_legge=nome_legge)
+
+    return len(nodes)
+
+
+def _delete_kb_source(tx, nome_legge, source):
+    """
+    Delete the nodes of `source` under `nome_legge`; returns how many RELATED
+    edges went with them. kb_ids are positions in the file, so the new
+    nodes cannot take over the old ones' edges.
+    """
+    # Nodes loaded before the manifest existed carry no source and are replaced too
+    record = tx.run("""
+        MATCH (d:Document {nome_legge: $nome_legge})-[:HAS*]->(n)
+        WHERE n.source = $source OR n.source IS NULL
+        WITH collect(DISTINCT n) AS nodes
+        UNWIND nodes AS n
+        OPTIONAL MATCH (n)-[r:RELATED]-()
+        WITH nodes, count(DISTINCT r) AS related
+        FOREACH (n IN nodes | DETACH DELETE n)
+        RETURN related
+        """, nome_legge=nome_legge, source=source).single()
+    return record['related'] if record else 0
+
+
+def ingest_kb_structure(file_path, neo4j_config, force=False):
+    source = os.path.basename(file_path)
+    content_hash = file_hash(file_path)
+    settings = {'kb_loader_version': KB_LOADER_VERSION}
+
+    with get_session(neo4j_config) as session:
+        entry = load_manifest(session, KB_MANIFEST_KIND).get(source)
+    if not force and is_current(entry, content_hash, settings_fingerprint(settings)):
+        logger.info(f"Skipping unchanged KB file: {file_path}")
+        return
+
     with open(file_path, 'r', encoding='utf-8') as file:
         try:
             data = json.load(file)
@@ -325,41 +767,310 @@ def ingest_kb_structure(file_path, neo4j_config):
             logger.warning(f"Invalid JSON file: {file_path}. Skipping.")
             return
 
-    driver = GraphDatabase.driver(
-        neo4j_config['url'],
-        database=neo4j_config['database'],
-        auth=(neo4j_config['user'], neo4j_config['password'])
-    )
+    # The previous version of the file is swapped out in a single transaction
+    with get_session(neo4j_config) as session:
+        _, nodes = flatten_kb(data, source)
+        _ensure_kb_indexes(session, {node['label'] for node in nodes})
 
-    with driver.session() as session:
-        create_kb_nodes(session, data)
+        with session.begin_transaction() as tx:
+            nome_legge = data.get("Document", {}).get("nome_legge", "Unknown")
+            dropped = _delete_kb_source(tx, nome_legge, source)
+            created = create_kb_nodes(tx, data, source=source)
+            record_ingest(tx, KB_MANIFEST_KIND, source,
+                          content_hash, settings)
+            tx.commit()
 
-    driver.close()
-    logger.info(f"KB structure from '{file_path}' ingested successfully.")
+    logger.info(
+        f"KB structure from '{file_path}' ingested successfully: {created} nodes.")
+    if dropped:
+        logger.warning(
+            f"Replacing '{file_path}' removed {dropped} RELATED edges of its previous nodes; "
+            f"rerun cluster.py and `ingest_doc.py related` to rebuild them.")
 
-    process_contenuto_nodes(neo4j_config)
 
+def load_kb(neo4j_config, force=False, resume=False, retry_failed=False):
+    checkpoint = Checkpoint('load_kb', resume=resume or retry_failed)
 
-def load_kb(neo4j_config):
-    file_location = "data/kb"
-    json_files = glob.glob(os.path.join(file_location, '*.json'))
+    if retry_failed:
+        json_files = sorted(checkpoint.failures)
+    else:
+        file_location = "data/kb"
+        json_files = glob.glob(os.path.join(file_location, '*.json'))
+        json_files = [json_file for json_file in json_files
+                      if not checkpoint.is_done(json_file)]
 
     print(f'#JSON files found: {len(json_files)}!')
 
     for json_file in json_files:
-        ingest_kb_structure(json_file, neo4j_config)
+        try:
+            ingest_kb_structure(json_file, neo4j_config, force)
+            checkpoint.mark_done(json_file)
+        except Exception as e:
+            checkpoint.record_failure(json_file, e)
+    checkpoint.finish(len(json_files))
+
+    # Embed once for the whole KB; only new or changed nodes are processed
+    process_contenuto_nodes(neo4j_config)
 
     logger.info("KB ingestion and processing completed.")
 
 
+def _kb_embedding_text(label, props):
+    # Same selection as process_contenuto_nodes
+    if label == 'contenuto':
+        contenuto = props.get('contenuto')
+        return contenuto if contenuto is not None else props.get('rubrica')
+    if label == 'parti':
+        return props.get('rubrica')
+    return None
+
+
+def _write_csv(output_dir, file_name, header, rows):
+    path = os.path.join(output_dir, file_name)
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return path
+
+
+def _csv_array(values):
+    return ';'.join(str(value) for value in values)
+
+
+def _open_csv(stack, output_dir, file_name, header):
+    """Open a CSV file for writing row by row, closed with `stack`; returns (path, writer)."""
+    path = os.path.join(output_dir, file_name)
+    file = stack.enter_context(open(path, 'w', encoding='utf-8', newline=''))
+    writer = csv.writer(file)
+    writer.writerow(header)
+    return path, writer
+
+
+def _export_docs(output_dir, nodes, relationships, queue_size=PIPELINE_QUEUE_SIZE):
+    """
+    Export every PDF in data/docs. Rows are written as each document is
+    enriched and at most `workers + queue_size` documents are split ahead,
+    so memory does not grow with the corpus; only entity ids are kept, to
+    write each entity once.
+    """
+    file_location = "data/docs"
+    pdf_files = sorted(glob.glob(os.path.join(file_location, '*.pdf')))
+    chunker = get_chunker()
+    settings = chunker.settings
+    fingerprint = settings_fingerprint(settings)
+
+    records = []
+    seen_entities = set()
+
+    with contextlib.ExitStack() as stack:
+        documents_path, documents = _open_csv(
+            stack, output_dir, 'documents.csv', ['id:ID', 'name', 'tag', ':LABEL'])
+        chunks_path, chunks = _open_csv(
+            stack, output_dir, 'chunks.csv',
+            ['chunk_id:ID', 'text', 'order:int', 'page_start:int', 'page_end:int',
+             'embedding:float[]', ':LABEL'])
+        entities_path, entities = _open_csv(
+            stack, output_dir, 'entities.csv', ['id:ID', 'text', 'label', ':LABEL'])
+        next_path, next_links = _open_csv(
+            stack, output_dir, 'next.csv', [':START_ID', ':END_ID', ':TYPE'])
+        has_entity_path, entity_links = _open_csv(
+            stack, output_dir, 'has_entity.csv', [':START_ID', ':END_ID', ':TYPE'])
+
+        def export(pdf_file, chunk_texts):
+            name = os.path.basename(pdf_file)
+            if not chunk_texts:
+                logger.warning(f"No chunks to export for document {pdf_file}")
+                return
+            try:
+                enriched = chunker.enrich_chunks(
+                    chunk_texts, labels=labels_for(infer_doc_type(pdf_file)))
+                chunk_rows, next_rows, entity_rows = _prepare_chunk_rows(
+                    name, enriched)
+            except Exception as e:
+                logger.error(f"Error exporting document {pdf_file}: {str(e)}")
+                return
+
+            doc_id = f"doc:{name}"
+            documents.writerow([doc_id, name, 'd', 'Document'])
+            records.append([f"record:{DOCS_MANIFEST_KIND}:{name}", DOCS_MANIFEST_KIND, name,
+                            file_hash(pdf_file), fingerprint,
+                            json.dumps(settings, sort_keys=True, ensure_ascii=False),
+                            'IngestRecord'])
+
+            for row in chunk_rows:
+                chunks.writerow([row['chunk_id'], row['text'], row['order'],
+                                 row['page_start'], row['page_end'],
+                                 _csv_array(row['embedding']), 'Chunk'])
+            if chunk_rows:
+                next_links.writerow([doc_id, chunk_rows[0]['chunk_id'], 'NEXT'])
+            for row in next_rows:
+                next_links.writerow([row['prev_id'], row['chunk_id'], 'NEXT'])
+            for row in entity_rows:
+                entity_id = 'entity:' + hashlib.sha1(
+                    f"{row['label']}\0{row['text']}".encode('utf-8')).hexdigest()
+                if entity_id not in seen_entities:
+                    seen_entities.add(entity_id)
+                    entities.writerow([entity_id, row['text'], row['label'], 'Entity'])
+                entity_links.writerow([row['chunk_id'], entity_id, 'HAS_ENTITY'])
+
+            logger.info(f"Exported document {name}: {len(chunk_rows)} chunks")
+
+        def collect(futures):
+            for future in futures:
+                pdf_file = submitted.pop(future)
+                try:
+                    chunk_texts = future.result()[1]
+                except Exception as e:
+                    logger.error(f"Error splitting document {pdf_file}: {str(e)}")
+                    continue
+                export(pdf_file, chunk_texts)
+
+        # Documents are split with the page-window path used by load_docs, so a
+        # large PDF never reaches spaCy as one string over nlp.max_length. As in
+        # load_docs the workers are spawned: the parent has loaded the embedder
+        workers = max(1, (os.cpu_count() or 2) - 1)
+        submitted = {}
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            for pdf_file in pdf_files:
+                if len(submitted) >= workers + queue_size:
+                    finished, _ = wait(
+                        submitted, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                submitted[pool.submit(
+                    prepare_document, pdf_file, chunker.splitter_options)] = pdf_file
+            collect(list(submitted))
+
+    nodes.extend([documents_path, chunks_path, entities_path])
+    relationships.extend([next_path, has_entity_path])
+    return records
+
+
+def _export_kb(output_dir, nodes, relationships, batch_size=EMBED_BATCH_SIZE):
+    file_location = "data/kb"
+    json_files = sorted(glob.glob(os.path.join(file_location, '*.json')))
+    settings = {'kb_loader_version': KB_LOADER_VERSION}
+    fingerprint = settings_fingerprint(settings)
+    model_name = get_embedder(legal=True).model_embedder.model_version
+
+    laws, records, has_links = {}, [], []
+    kb_nodes = defaultdict(list)
+
+    for json_file in json_files:
+        source = os.path.basename(json_file)
+        with open(json_file, 'r', encoding='utf-8') as file:
+            try:
+                data = json.load(file)
+            except json.JSONDecodeError:
+                logger.warning(f"Invalid JSON file: {json_file}. Skipping.")
+                continue
+
+        document, file_nodes = flatten_kb(data, source)
+        law_id = None
+        if document is not None:
+            nome_legge = document.get("nome_legge", "Unknown")
+            law_id = f"law:{nome_legge}"
+            laws[law_id] = [law_id, nome_legge, 'Document']
+
+        for node in file_nodes:
+            kb_nodes[node['label']].append(node)
+            parent_id = node['parent_id'] if node['parent_id'] is not None else law_id
+            if parent_id is not None and node['parent_label'] is not None:
+                has_links.append([parent_id, node['kb_id'], 'HAS'])
+
+        records.append([f"record:{KB_MANIFEST_KIND}:{source}", KB_MANIFEST_KIND, source,
+                        file_hash(json_file), fingerprint,
+                        json.dumps(settings, sort_keys=True, ensure_ascii=False),
+                        'IngestRecord'])
+        logger.info(f"Exported KB file {source}: {len(file_nodes)} nodes")
+
+    nodes.append(_write_csv(output_dir, 'laws.csv',
+                            ['id:ID', 'nome_legge', ':LABEL'], laws.values()))
+
+    for label, label_nodes in kb_nodes.items():
+        to_embed = [(node, _kb_embedding_text(label, node['props']))
+                    for node in label_nodes]
+        to_embed = [(node, text) for node, text in to_embed if text]
+        for batch in batched(to_embed, batch_size):
+            embeddings = get_embedder(legal=True).get_embeddings([text for _, text in batch])
+            for (node, text), embedding in zip(batch, embeddings):
+                node['embedding'] = embedding
+                node['embedding_hash'] = _embedding_hash(text, model_name)
+
+        keys = sorted({key for node in label_nodes for key in node['props']} - {'kb_id'})
+        header = ['kb_id:ID'] + keys + ['embedding:float[]', 'embedding_hash', ':LABEL']
+        rows = []
+        for node in label_nodes:
+            props = node['props']
+            rows.append([node['kb_id']] + [props.get(key) for key in keys] + [
+                _csv_array(node['embedding']) if 'embedding' in node else None,
+                node.get('embedding_hash'),
+                label])
+        nodes.append(_write_csv(output_dir, f"kb_{label}.csv", header, rows))
+
+    relationships.append(_write_csv(output_dir, 'has.csv',
+                                    [':START_ID', ':END_ID', ':TYPE'], has_links))
+    return records
+
+
+def export_bulk_import(output_dir):
+    """
+    Write the document/chunk/entity graph and the law hierarchy, embeddings
+    included, as CSV files for `neo4j-admin database import full`. Ids are
+    the same stable ids used by the transactional loaders, and IngestRecord
+    nodes are exported too, so incremental runs after the import skip
+    unchanged files.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    nodes, relationships = [], []
+
+    records = _export_docs(output_dir, nodes, relationships)
+    records += _export_kb(output_dir, nodes, relationships)
+    nodes.append(_write_csv(output_dir, 'ingest_records.csv',
+                            ['id:ID', 'kind', 'source', 'content_hash', 'fingerprint', 'settings', ':LABEL'],
+                            records))
+
+    command = ' '.join(
+        ['neo4j-admin database import full', '--multiline-fields=true']
+        + [f'--nodes="{path}"' for path in nodes]
+        + [f'--relationships="{path}"' for path in relationships]
+        + ['neo4j'])
+    logger.info(f"Bulk import files written to {output_dir}. Import into a fresh database with:\n{command}")
+    return command
+
+
 if __name__ == "__main__":
-    neo4j_config = {
-        'url': 'neo4j+ssc://bc1e22a5.databases.neo4j.io',
-        'database': 'neo4j',
-        'user': 'neo4j',
-        'password': '-'
-    }
-    #load_docs(neo4j_config)
-    #load_kb(neo4j_config)
-    #process_contenuto_nodes(neo4j_config)
-    #related_intentional(neo4j_config)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('job', choices=['docs', 'kb', 'embed', 'related', 'export'],
+                        help='Ingestion job to run')
+    parser.add_argument('--config', type=str, default='config.yaml',
+                        help='Path to config file')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-ingest files even if unchanged')
+    parser.add_argument('--output', type=str, default='data/bulk_import',
+                        help='Output directory for the export job')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted run from its checkpoint')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='Only process the items that failed in the last run')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+    neo4j_config = config['neo4j_config']
+    configure(config)
+
+    if args.job == 'docs':
+        load_docs(neo4j_config, force=args.force,
+                  resume=args.resume, retry_failed=args.retry_failed)
+    elif args.job == 'kb':
+        load_kb(neo4j_config, force=args.force,
+                resume=args.resume, retry_failed=args.retry_failed)
+    elif args.job == 'embed':
+        process_contenuto_nodes(neo4j_config, force=args.force,
+                                resume=args.resume, retry_failed=args.retry_failed)
+    elif args.job == 'related':
+        related_intentional(neo4j_config, resume=args.resume,
+                            retry_failed=args.retry_failed)
+    elif args.job == 'export':
+        export_bulk_import(args.output)
@@ -7,8 +7,8 @@ import json
 import os
 from datetime import datetime
 from models.graph_att import GraphSearcher
+from models.registry import configure
 from typing import Dict, Any
-import boto3
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -105,8 +105,10 @@ def parse_api_calls(response):
 
 
 def main(config: Dict[str, Any]):
-    searcher = GraphSearcher(config['neo4j_config'])
+    searcher = GraphSearcher(config['neo4j_config'], config.get('embedding_backend'))
 
+    # Imported here so the CLI starts without loading the AWS SDK
+    import boto3
     bedrock_runtime = boto3.client(
         service_name="bedrock-runtime",
         region_name="us-east-1"
@@ -233,4 +235,5 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     config = load_config(args.config)
+    configure(config)
     main(config)
@@ -1,9 +1,17 @@
+import argparse
+import bisect
+import inspect
+import itertools
 import os
+import time
 import fitz  
 import spacy
 from spacy.language import Language
-from models.entity_extractor import EntityExtractor
-from typing import List, Dict
+from models.entity_extractor import EntityExtractor, LABEL_SETS, infer_doc_type, labels_for
+from models.embedding_cache import EMBEDDING_CACHE_PATH, get_cache
+from models.embedding_server import RemoteEmbeddings
+from models import registry
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import re
 import logging
 import numpy as np
@@ -12,21 +20,170 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 import torch
-from transformers import AutoTokenizer, AutoModel
+from transformers import AutoConfig, AutoTokenizer, AutoModel
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Numbered list markers such as "1." that should not end a sentence
+NUMBERED_ITEM = re.compile(r'^\d+\.$')
+
+# Texts per forward pass when embedding; batches are padded dynamically
+EMBEDDING_BATCH_SIZE = 32
+
+LEGAL_MODEL_NAME = "dlicari/Italian-Legal-BERT"
+GENERAL_MODEL_NAME = "DeepMount00/Anita"
+# Token budget of a chunk in 'tokens' chunking mode, special tokens excluded
+MAX_CHUNK_TOKENS = 256
+
+# Embedding backends selectable per ModelEmbeddings or with EMBEDDING_BACKEND
+EMBEDDING_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+# Exported (and quantized) ONNX models
+ONNX_DIR = 'data/onnx'
+# Bumped when exports change so stale exports and the vectors they produced are not reused
+ONNX_EXPORT_REVISION = 2
+# Sample sentences embedded by both backends in check_backend_parity
+PARITY_TEXTS = [
+    "Il venditore è obbligato a consegnare la cosa al compratore.",
+    "Art. 1218 c.c. - Responsabilità del debitore.",
+    "Il contratto è l'accordo di due o più parti per costituire, regolare o estinguere tra loro un rapporto giuridico patrimoniale.",
+    "La busta paga riporta una retribuzione lorda di 2.350,00 euro.",
+    "Sentenza n. 123/2020 del Tribunale di Milano, sez. lavoro.",
+]
+
+# PDF pages segmented together when streaming a document
+PAGE_WINDOW = 4
+# Chunk texts enriched together when streaming chunks out of chunk_text
+STREAM_BATCH_CHUNKS = 64
+
+# Custom abbreviations for Italian
+ABBREVIATIONS = set([
+    'art', 'dr', 'dott', 'prof', 'ing', 'arch', 'avv', 'sig', 'st', 'ss',
+
+    'v', 'vs', 'etc', 'ecc', 'es', 'pag', 'n', 'nr', 'fig', 'tab', 'ibid',
+
+    'cap', 'cit', 'op', 'cf', 'ca', 'max', 'min', 'ab', 'ad', 'al', 'c', ':', 'S.p',
+
+    'd', 'f', 'h', 'i', 'l', 'm', 'o', 'p', 'q', 'r', 's', 't', 'u', 'x', '1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12', '13', '14', '15', '16', '(', 'ac', 'ad', 'all', 'Amn', 'Arch', 'Avv', 'Bcc', 'CA', 'ca', 'CAP', 'CAP', 'Cc', 'c/c banc', 'c/c post', 'ccp', 'Chiamo', 'cm', 'c/o', 'Co', 'cp', 'CP', 'Cpr', 'Cso', 'corr', 'cs', 'cv', 'Dott', 'Dottssa', 'Dr', 'ecc', 'Egr', 'Egri', 'Egria', 'epc', 'fatt', 'Flli', 'Gentmo', 'Gentmi', 'Gentma', 'Gentme', 'Geom', 'g', 'gg', 'Id', 'Illmo', 'Ing', 'int', 'lett', 'Mo', 'Mons', 'NB', 'N/', 'ns', 'n°', 'n', 'ogg', 'on', 'p', 'pag', 'p', 'pp', 'pc', 'pc', 'pcc', 'pes', 'pf', 'pr', 'PS', 'pv', 'Pza', 'PT', 'Pregmo', 'Profssa', 'Prof', 'R', 'racc', 'Rag', 'Rev',
+
+    'ric', 'Rif', 'RP', 'RSVP', 'SA', 'S acc', 'SBF', 'S E & O', 'seg', 'sgg', 'ss', 'Sig', 'Sigg', 'Signa', 'Sigra', 'Sigra/signa', 'snc', 'Soc', 'SpA', 'Spett', 'SPM', 'Srl', 'Stimmo', 'tel', 'us', 'V', 'V/', 'vs', 'Vip', 'Vle', 'VP', 'vr', 'vs', 'AAS', 'ABGB', 'abr', 'acc', 'al', 'all', 'art', 'ASS', 'Atti parl Cam', 'Atti parl Sen', 'Aue',
+
+    'BUAbr', 'BUBasil', 'BUCal', 'BUCamp', 'BUEmRom', 'BUFVG', 'BULazio', 'BULig', 'BULomb', 'BUMarche', 'BUMol', 'BUPiem', 'BUPuglia', 'BUSar', 'BUTAA', 'BUTosc', 'BUUmbria', 'BUVdA', 'BUVen', 'Bull off', 'C', 'can', 'cap', 'cc', 'cceo', 'cc fr', 'c comm', 'c comm fr', 'CdM', 'Cedu', 'cic', 'circ', 'c nav', 'co', 'conc', 'conv', 'convenz', 'cost', 'cp', 'cpc', 'cpc fr', 'cp fr', 'cpmilg', 'cpmilp', 'cpp', 'cpp fr', 'cpv', 'D', 'dCG', 'dCpS', 'dec', 'dec Ceca', 'dec Cee', 'dec Ce', 'del', 'd interm', 'dir', 'dir Ceca', 'dir Cee', 'dir Ce', 'disp att', 'disp att coord', 'disp coord', 'disp prel', 'disp trans', 'dl', 'dlg', 'dlg CpS', 'dlg lt', 'dlg PC', 'dlg PR', 'dl lt', 'dlt', 'dm', 'doc', 'dPC', 'dPR', 'd ric amm', 'GU', 'GUCE', 'GUSic',
+
+    'lin', 'l lav pa', 'l miner', 'l proc', 'l prov B', 'l prov T', 'l rg', 'l tar', 'm', 'mod', 'OR', 'ord giud', 'ord giur amm', 'prot', 'rd', 'rdl', 'rd lg', 'reg', 'reg ass benef', 'reg brev', 'reg Ceca', 'reg Cee', 'reg Ce', 'reg c nav', 'reg com prov', 'reg cont', 'reg esec', 'reg nav aerea', 'reg proc C conti', 'reg ps', 'reg rg', 'rel', 'st', 'tab', 'tit', 'tr', 'tr Ce', 'tr Ceca', 'tu', 'tu acque pubbl', 'tu avv St', 'tu b cult', 'tu C conti', 'tu com prov 1915', 'tu com prov 1934', 'tu Cons St', 'tu doc amm', 'tu edil', 'tu espr pu', 'tu fin loc', 'tu immigr', 'tu imp civ St', 'tu imp dr 1986', 'tu inf lav', 'tu pensioni', 'tu ps', 'vig', 'abr', 'arg', 'c', 'cap', 'cd', 'cfr', 'cit', 'conf', 'diff', 'ed', 'ined', 'lb', 'loc', 'lett', 'n', 'nt', 'op', 'p', 'pt', 'pt g', 'pt s', 'rist', 'rubr', 's ss', 'sd', 'sl', 'sess', 'sez', 'sr', 'suppl', 't', 'ult', 'v', 'vig', '§', 'App', 'App mil', 'Ass', 'Ass app', 'Cass', 'C conti', 'C cost', 'C eur du', 'C giust Ceca', 'C giust Ce', 'CIJ', 'Comm brevetti', 'Comm centr imp', 'Comm ed pop', 'Comm tribut 1o', 'Comm tribut 2o', 'Comm tribut centr', 'Cons reg sic', 'Cons St', 'CPJI', 'C reg sic', 'Gpa', 'Pret',
+
+    'Tar', 'Trib', 'Trib acque', 'Trib Ce', 'Trib mil', 'Trib sup acque', 'Trib supr mil', 'D disc pen', 'D disc priv', 'D disc pubbl', 'DI', 'Enc Br', 'Enc Dalloz civ', 'Enc Dalloz comm', 'Enc Dalloz crim', 'Enc Dalloz intern', 'Enc Dalloz proc civ', 'Enc Dalloz publ', 'Enc Dalloz soc trav', 'Enc dir', 'Enc giur', 'Enc giur it', 'Enc it', 'NDI', 'N rép Dalloz', 'Nss DI', 'Rép Dalloz', 'Tr dir amm eur', 'Trattato Orlando', 'Acque bon costr', 'Adl', 'Adm Law Rev', 'Adm publ', 'Adm Soc', 'Aff esteri', 'Aff soc internaz', 'Agg soc', 'Agr it', 'Ambiente', 'Am journ compar Law', 'Amm civ', 'Amm giud', 'Ammin', 'Ann Bari', 'Ann Camerino', 'Ann Catania', 'Ann dir intern', 'Ann Ferrara', 'Ann Genova', 'Ann Macerata', 'Ann Messina', 'Ann Palermo', 'Ann Perugia', 'Ann pi', 'Ann Rev Pol Sc', 'Ann sem Palermo', 'Ann stor dir', 'Ann triestini', 'Ann dir comp', 'Anr inst dr intern', 'App urb edil',
+
+    'Arch civ', 'Arch dir eccl', 'Arch dir pubbl', 'Arch fin', 'Arch giur', 'Arch giur circ', 'Arch giur op pubbl', 'Arch loc', 'Arch nuova proc pen', 'Arch pen', 'Arch ph dr', 'Arch resp civ', 'Arch ric giur', 'Arch st corp', 'Arch stor it', 'Arch ven', 'Asi', 'Assic', 'Assist soc', 'Azienda pubbl', 'Azienditalia', 'Banca borsa', 'Banca borsa tit cred', 'Banca cred', 'Banca impr soc', 'Boll ass cass risp', 'Boll ass it dir maritt', 'Boll cost parl', 'Boll for', 'Boll legisl tecn', 'Boll tribut', 'Br intern Law', 'Bull soc leg comp', 'Cahiers dr europ', 'Cal giud', 'Can Bar Rev', 'Carte stor', 'Cass pen', 'Cass pen mass', 'CIJ Recueil', 'Circ trasp', 'Civ catt', 'Comm Market Rep', 'Comm Market Rev', 'Comp stat it', 'Comuni dIt', 'Comun intern', 'Contr', 'Contr impr', 'Contr impr eur', 'Controllo legale conti', 'Corr trib', 'Corr giur', 'Crit dir', 'Crit econ', 'Crit pen', 'Crit pol', 'Crit soc', 'Crit sociol', 'Danno resp', 'D&G', 'Dem dir', 'Dif contr', 'Dir amm', 'Dir aut', 'Dir autom', 'Dir banca mercato fin', 'Dir b pubbl', 'Dir comm', 'Dir commercio intern', 'Dir comunit scambi intern', 'Dir eccl', 'Dir ed econ', 'Dir econ assic', 'Dir fall', 'Dir gest ambiente', 'Dir giur', 'Dir giur agr amb', 'Dir immigraz cittadinanza', 'Dir ind', 'Dir intern', 'Dir intern bell', 'Dir lav', 'Dir merc lav', 'Dir militare', 'Dir pen processo', 'Dir prat assic', 'Dir prat comm', 'Dir prat lav', 'Diritto prat soc', 'Dir prat tribut', 'Dir priv', 'Dir proc amm', 'Dir pubbl', 'Dir pubbl comp eur', 'Dir pubbl reg', 'Dir relaz ind', 'Dir san', 'Dir soc', 'Dir trasp', 'Dir Ue', 'Disciplina comm', 'DL Riv critica dir lav', 'Doc it', 'Dr adm', 'Dr inform tel', 'Droits', 'DVerw', 'Econ ambiente', 'Econ cultura', 'Econ intern', 'Econ dir terz', 'Econ intern en', 'Econ it', 'Econ pubbl', 'Ed cred', 'Ed terr', 'Enc com', 'Energia', 'Enti pubbl', 'Es imp dir fisc', 'EDCE', 'ER',
+
+    'Europa dir priv', 'Eur Competition Law Rev', 'Eur Law J', 'Eur Law Rev', 'Eur Leg For', 'Fin loc', 'Fordham Intern Law J', 'Foro ambr', 'Foro amm Tar', 'Foro it', 'Foro nap', 'Foro Sal', 'Foro tosc', 'Funz pubbl', 'Gazz ambiente', 'Gazz giur', 'Gazz loc', 'Gazz tribut', 'Giorn dir amm', 'Giorn dir lav rel ind', 'Giorn stor cost', 'Giur agr it', 'Giur annotata dir ind', 'Giur boll legisl tecn', 'Giur comm', 'Giur comp dir civ', 'Giur compl cass civ', 'Giur compl cass pen', 'Giur Corti reg', 'Giur cost', 'Giur imp', 'Giur imp dr', 'Giur imp dr reg neg', 'Giur infort', 'Giur it', 'Giur lav', 'Giur merito', 'Giur milanese', 'Giur napoletana', 'Giur op pubbl', 'Giur piemontese', 'Giur romana', 'Giur samm', 'Giur sic', 'Giur tor', 'Giur tosc', 'Gius', 'Giust', 'Giust amm', 'Giust amm sic', 'Giust autom', 'Giust civ', 'Giust civ mass app', 'Giust civ Mass', 'Giust Cost', 'Giust fin', 'Giustit', 'Giust pen', 'Gov', 'GT riv giur trib', 'Guida dir', 'Guida el', 'Guida lav', 'Harv Intern Law J', 'Harv Law Rev', 'Hastings Intern Comp Law Rev', 'Hist J', 'Ig sic lav', 'Imp cons entr', 'Impos dr', 'Industria', 'Ind sind', 'Informatica dir', 'Informatica doc', 'Informaz previd', 'Inf tribut comm', 'Intern Law Pol', 'Intern Law Quart', 'Intern Law Rev', 'Intern Leg Mat', 'Intern J Soc Law', 'Intern Org', 'Ist federalismo', 'J dr intern', 'J dr intern priv', 'J eur Verw', 'J intern ausl öff R', 'J öff R', 'J Comm Market St', 'J Econ Liter', 'J Env Law', 'J Eur Publ Pol', 'J Inst Th Econ', 'J Leg St', 'J Pubbl Pol', 'Lav dir', 'Lav nella giur', 'Lav prev oggi', 'Lav rel ind', 'Lav sicur soc', 'Law Pol', 'Leg it',
+
+    'Leg pen', 'Leg St', 'Mass Ced', 'Mass dec pen', 'Mass giur it', 'giur', 'it', 'Mass giur lav', 'Mass Pen', 'Mass tribut', 'Mass trib supr mil', 'Mat stor cultura giur', 'MCR', 'Meridiana', 'Min it', 'Mn cred', 'Mom leg', 'Mon eccl', 'Mon pret', 'Mon trib', 'Mondo banc', 'Mondo giud', 'N arch ven', 'N dir', 'N dir agr', 'N leg pen', 'Nomos', 'Nord sud', 'Not giur lav', 'Not giur reg', 'Not fall', 'Not lav prev', 'N rass amm com', 'N rass ldg', 'N giur civ commentata', 'N riv app', 'N riv dir comm', 'N riv tribut', 'Nuove leggi civili', 'Or econ', 'Orient giur lav', 'Oss leg', 'Parl Aff', 'Pitts LR', 'Polis', 'Pol', 'Pol dir', 'Pol man publ', 'Pol Q', 'Pol parl', 'Pol Sc', 'Pol St', 'Poste tel', 'Pouvoirs', 'PQM', 'Prat az', 'Prevenz infort', 'Prev soc', 'Prev soc agr', 'PSQ', 'Prob amm pubbl', 'Prob Inf', 'Publ Adm', 'Publ Adm Dev', 'Publ Adm Rev', 'Publ Choice', 'Publ Law', 'Publ Pol Adm', 'Quad amm', 'Quad cost', 'Quad dir lav rel ind', 'Quad fior stor', 'Quad min fin', 'Quad reg', 'Quad sc pol', 'Racc Cons St', 'Racc giur C giust', 'Ragiufarm', 'Ragiusan', 'Rass amm sanita', 'Rass amm scuola', 'Rass arch St', 'Rass avv Napoli', 'Rass Avv St', 'Rass circ str', 'Rass dir cinem', 'Rass dir civ', 'Rass dir dog', 'Rass dir eccl', 'Rass dir farm', 'Rass dir pubbl', 'Rass dir san', 'Rass econ', 'Rass fin pubbl', 'Rass fin tribut', 'Rass forense', 'Rass giur Enel', 'Rass giur en elettr', 'Rass giur ist st leg', 'Rass giur s', 'Rass giur u', 'Rass giust mil', 'Rass imp dr', 'Rass lav', 'Rass lav pubbl', 'Rass parl', 'Rass penit crim', 'Rass penit criminol', 'Rass propr ila', 'Rass stat lav', 'Rass st penit', 'Rass tribut', 'Reg', 'Rel intern', 'Resp civ prev', 'Resp comunic impr', 'Rev adm publica', 'Rev der com eur', 'Rev es der adm', 'Rev esp der intern', 'Rev adm', 'Rev adm publ', 'Rev affaires europe´ennes', 'Rev crit dr intern priv', 'Rev dr intern dr comp', 'Rev dr intern leg comp', 'Rev dr intern sc dipl pol', 'Rev dr publ', 'Rev dr Ue', 'Rev eur dr publ', 'Rev fr adm publ', 'Rev fr dr adm', 'Rev fr sc pol', 'Rev ge´n dr', 'Rev ge´n dr intern', 'Rev hist dr fr', 'Rev intern dr comp', 'Rev intern sc adm', 'Rev MCUE', 'Rev MUE', 'Rev pol parl', 'Rev trim dr civ', 'Rev trim dr comm', 'Rev trim dr europ', 'Rev trim dr homme',
+
+    'RHD', 'Riv Ag terr', 'Riv amm', 'Riv amm app', 'Riv arbitrato', 'Riv banc', 'Riv cass risp', 'Riv cat', 'Riv C conti', 'Riv coop', 'Riv crit dir giur', 'Riv crit dir priv', 'Riv crit infort lav', 'Riv dem', 'Riv dif soc', 'Riv dip terr', 'Riv dir aer', 'Riv dir agr', 'Riv dir civ', 'Riv dir comm', 'Riv dir cost', 'Riv dir eur', 'Riv dir fin', 'Riv dir impresa', 'Riv dir ind', 'Riv dir intern', 'Riv dir intern comp lav', 'Riv dir intern priv proc', 'Riv dir ipot', 'Riv dir lav', 'Riv dir lav mass', 'Riv dir matr', 'Riv dir mil', 'Riv dir miner', 'Riv dir nav', 'Riv dir penit', 'Riv dir priv', 'Riv dir proc', 'Riv dir proc civ', 'Riv dir proc pen', 'Riv dir pubbl', 'Riv dir sic soc', 'Riv dir sport', 'Riv dir tribut', 'Riv dott comm', 'Riv econ Mezz', 'Riv es forz', 'Riv fil', 'Riv fisc', 'Riv giur ambiente', 'Riv giur circ trasp', 'Riv giur edil', 'Riv giur lav', 'Riv giur magistr', 'Riv giur Mezz', 'Riv giur polizia', 'Uff', 'Vol', 'PQM', 'nr', 'est', 'cf', 'segg', 'sigg ri', 'tg', 'PM', 'cpa', 'iva', 'loc', 'cp c', 'cod proc civ', 'gd', 'sp', 'Disp Att', 'GIP', 'GUP', 'CC', 'CPC', 'CP', 'CPP', 'pubbl', 'ar', 'ab', 'ab km²', 'ab kmq', 'abbigl', 'abbrev', 'abl', 'aC', 'ac', 'acc', 'accorc', 'accr', 'adatt', 'adr', 'aeron', 'aerodin', 'affl', 'agg', 'agr', 'agric', 'alch', 'alg', 'alim', 'allev', 'allus', 'alt',
+
+    'anat', 'anat comp', 'ant', 'antifr', 'anton', 'antrop', 'ar', 'arald', 'arc', 'arch', 'archeol', 'aritm', 'arred', 'art', 'arti min', 'artig', 'artigl', 'artt', 'assic', 'assol', 'astr', 'astrol', 'astron', 'att', 'attrav', 'aus', 'autom', 'avv', 'avvers', 'bal', 'ball', 'batt', 'bibl', 'bioch', 'biol', 'bot', 'bur', 'ca', 'cal', 'cap', 'capol', 'card', 'caus', 'ca', 'cm', 'cd', 'cd', 'a', 'centr', 'cfr', 'chim', 'chim ind', 'chir', 'ciber', 'cin', 'citol', 'class', 'cm²', 'cmq', 'cod civ',
+
+    'enol', 'entom', 'epigr', 'es', 'escl', 'estens', 'estr min', 'etim', 'etn', 'etol', 'eufem', 'fam', 'farm', 'ferr', 'fig', 'filat', 'filol', 'filos', 'fin', 'fis', 'fisiol', 'fisiopatol', 'folcl', 'fon', 'fotogr', 'fr', 'fut', 'gen', 'geneal', 'geod', 'geofis', 'geogr', 'geogr antr', 'geogr fis', 'geol', 'geom', 'germ', 'giorn', 'gr', 'gram', 'ibid', 'icon', 'id', 'idraul', 'ig', 'imp', 'imper', 'imperf', 'impers', 'ind', 'ind agr', 'ind alim', 'ind cart', 'ind chim', 'ind cuoio', 'ind estratt', 'ind graf', 'ind mecc', 'ind tess', 'indecl', 'indef', 'indeterm', 'inf', 'inform', 'ing', 'ingl', 'ins', 'inter', 'intr', 'invar', 'iron', 'irreg', 'is', 'istol', 'it', 'ittiol', 'lat', 'lav femm', 'lav pubbl', 'lett', 'ling', 'lit', 'loc', 'loc div', 'long', 'macch', 'mar', 'mat', 'mater', 'max', 'mecc', 'med', 'mediev', 'merc', 'merid', 'metall', 'meteor', 'metr', 'metrol', 'microb', 'mil', 'min', 'miner', 'mitol', 'mod', 'morf', 'mss', 'mus', 'na', 'neg', 'neol', 'neur', 'nom', 'numism', 'oc', 'occ', 'occult', 'oculist', 'od', 'ogg', 'oland', 'onomat', 'ord', 'ord scol', 'oref', 'orient', 'ornit', 'orogr', 'ott', 'pa', 'pag', 'pagg', 'paleobot', 'paleogr', 'paleont', 'paleozool', 'paletn', 'papir', 'parapsicol', 'part', 'partic', 'pass', 'patol', 'pedag', 'pegg', 'per ind', 'pers',
+
+    'petr', 'petrogr', 'pitt', ' D.Lgs', 'pl', 'poet', 'pol', 'popol', 'port', 'poss', 'pr', 'pref', 'preist', 'prep', 'pres', 'pret', 'priv', 'prof', 'pron', 'pronom', 'propr', 'prov', 'prox', 'psicoan', 'psicol', 'qc', 'qlc', 'qlcn', 'qlco', 'qlcs', 'qlcu', 'qualif', 'radiotecn', 'rag', 'rar', 'recipr', 'reg', 'region', 'rel', 'rem', 'rep', 'retor', 'rifl', 'rit', 'rom', 'scherz', 'scien', 'scult', 'sec', 'secc', 'seg', 'segg', 'sigill', 'sig', 'sigg', 'sig ra', 'sig na', 'simb', 'sin', 'sing', 's/m', 'sociol', 'sogg', 'sp', 'spett', 'spreg', 'st', 'stat', 'st d arte', 'st d dir', 'st d filos', 'st d rel', 'suff', 'sup', 'superl', 'tav', 'tecn', 'tecnol', 'ted', 'tel', 'telecom', 'temp', 'teol', 'term', 'tess', 'tipogr', 'top', 'topog', 'tosc', 'tr', 'trad', 'trasp', 'ungh', 'urban', 'val', 'vd', 'veter', 'vezz', 'voc', 'vol', 'volg', 'voll', 'zool', 'zoot', 'disp att cc', 'succ mod', 'ss mm ii', 'co', 'D Lgs', 'cd', 'sez un', 'sent', 'nn', 't a r', 'rv', 'ric n', 'fall', 'l c a', 't u b', 'Cass civ'
+])
+
+# Lower-cased, dot-stripped form of ABBREVIATIONS, as compared against tokens
+ABBREVIATION_LOOKUP = frozenset(abbr.lower().rstrip('.') for abbr in ABBREVIATIONS)
+
+
+def resolve_backend(backend: Optional[str] = None) -> str:
+    backend = backend or os.environ.get('EMBEDDING_BACKEND', 'torch')
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    return backend
+
+
+def model_version(model_name: str, backend: str) -> str:
+    # Identifies the vectors produced: ONNX and int8 vectors differ slightly from PyTorch's
+    return model_name if backend == 'torch' else f"{model_name}@{backend}-r{ONNX_EXPORT_REVISION}"
+
+
+def _onnx_path(model_name: str, quantize: bool) -> str:
+    directory = os.path.join(ONNX_DIR, model_name.replace('/', '__'))
+    name = 'model.int8' if quantize else 'model'
+    return os.path.join(directory, f"{name}.r{ONNX_EXPORT_REVISION}.onnx")
+
+
+def export_onnx(model_name: str, quantize: bool = False) -> str:
+    """
+    Export `model_name` to ONNX with dynamic batch and sequence axes, and
+    optionally quantize its weights to int8. Exports are cached on disk
+    under ONNX_DIR; returns the path of the model to load.
+    """
+    path = _onnx_path(model_name, quantize=False)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        logger.info(f"Exporting {model_name} to ONNX: {path}")
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name).eval()
+        sample = dict(tokenizer(["Art. 1 del codice civile."], return_tensors='pt'))
+        # torch binds positional inputs in forward() order (input_ids,
+        # attention_mask, token_type_ids), not in the tokenizer's order
+        input_names = [name for name in inspect.signature(model.forward).parameters
+                       if name in sample]
+        dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+        dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+        with torch.no_grad():
+            torch.onnx.export(
+                model, tuple(sample[name] for name in input_names), path,
+                input_names=input_names,
+                output_names=['last_hidden_state'],
+                dynamic_axes=dynamic_axes,
+                opset_version=14)
+
+    if not quantize:
+        return path
+
+    quantized_path = _onnx_path(model_name, quantize=True)
+    if not os.path.exists(quantized_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        logger.info(f"Quantizing {path} to int8: {quantized_path}")
+        quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+    return quantized_path
+
+
+def _onnx_session(path: str):
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise ImportError(
+            "The onnx embedding backends need onnxruntime: pip install onnxruntime") from e
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+
 class ModelEmbeddings:
-    def __init__(self, legal: bool = True):
+    def __init__(self, legal: bool = True, backend: Optional[str] = None):
+        """
+        `backend` is 'torch' (default), 'onnx' or 'onnx-int8'; when not given
+        it is read from the EMBEDDING_BACKEND environment variable.
+        """
         self.legal = legal
-        self.model_name = "dlicari/Italian-Legal-BERT" if legal else "DeepMount00/Anita"
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        
-        logger.info(f"Loading model: {self.model_name} on {self.device}")
+        self.model_name = LEGAL_MODEL_NAME if legal else GENERAL_MODEL_NAME
+        self.backend = resolve_backend(backend)
+        self.model_version = model_version(self.model_name, self.backend)
+
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-        self.model = AutoModel.from_pretrained(self.model_name).to(self.device)
-        self.embedding_size = self.model.config.hidden_size
+        if self.backend == 'torch':
+            self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            logger.info(f"Loading model: {self.model_name} on {self.device}")
+            self.model = AutoModel.from_pretrained(self.model_name).to(self.device)
+            self.embedding_size = self.model.config.hidden_size
+        else:
+            logger.info(f"Loading model: {self.model_name} with ONNX Runtime ({self.backend})")
+            self.session = _onnx_session(
+                export_onnx(self.model_name, quantize=self.backend == 'onnx-int8'))
+            self.session_inputs = [node.name for node in self.session.get_inputs()]
+            self.embedding_size = AutoConfig.from_pretrained(self.model_name).hidden_size
         logger.info(f"Model loaded with embedding size: {self.embedding_size}")
 
     def mean_pooling(self, model_output, attention_mask):
@@ -36,8 +193,26 @@ class ModelEmbeddings:
         sum_mask = torch.clamp(input_mask_expanded.sum(1), min=1e-9)
         return sum_embeddings / sum_mask
 
-    def get_embeddings(self, texts: List[str], max_length: int = 512) -> List[List[float]]:
+    def get_embeddings(self, texts: List[str], max_length: int = 512, batch_size: int = EMBEDDING_BATCH_SIZE) -> np.ndarray:
+        """
+        Embed `texts` in batches of `batch_size` into a (len(texts),
+        embedding_size) float32 array. Texts are sorted by length first so
+        each batch is padded only to its own longest text, and the rows are
+        returned in the original order.
+        """
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        embeddings = np.zeros((len(texts), self.embedding_size), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            batch_indices = order[start:start + batch_size]
+            embeddings[batch_indices] = self._embed_batch(
+                [texts[i] for i in batch_indices], max_length)
+        return embeddings
+
+    def _embed_batch(self, texts: List[str], max_length: int) -> np.ndarray:
         try:
+            if self.backend != 'torch':
+                return self._embed_batch_onnx(texts, max_length)
+
             encoded_input = self.tokenizer(
                 texts,
                 padding=True,
@@ -54,88 +229,130 @@ class ModelEmbeddings:
                 encoded_input['attention_mask']
             )
             
-            return embeddings.cpu().numpy().tolist()
+            return embeddings.cpu().numpy().astype(np.float32, copy=False)
 
         except Exception as e:
             logger.error(f"Error generating embeddings: {str(e)}")
-            return [[0.0] * self.embedding_size] * len(texts)
+            return np.zeros((len(texts), self.embedding_size), dtype=np.float32)
+
+    def _embed_batch_onnx(self, texts: List[str], max_length: int) -> np.ndarray:
+        encoded_input = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=max_length,
+            return_tensors='np'
+        )
+        feeds = {name: encoded_input[name].astype(np.int64) for name in self.session_inputs}
+        token_embeddings = self.session.run(['last_hidden_state'], feeds)[0]
+
+        # Same mean pooling as the PyTorch backend
+        mask = encoded_input['attention_mask'][..., None].astype(np.float32)
+        embeddings = (token_embeddings * mask).sum(1) / np.clip(mask.sum(1), 1e-9, None)
+        return embeddings.astype(np.float32, copy=False)
 
-    def embed_query(self, text: str) -> List[float]:
+    def embed_query(self, text: str) -> np.ndarray:
         return self.get_embeddings([text])[0]
 
 
 class Embedder:
-    def __init__(self, legal: bool = True):
-        self.model_embedder = ModelEmbeddings(legal=legal)
+    def __init__(self, legal: bool = True, cache_path: Optional[str] = EMBEDDING_CACHE_PATH,
+                 backend: Optional[str] = None, server_url: Optional[str] = None):
+        """
+        With `server_url` (or EMBEDDING_SERVER_URL) texts are embedded by a
+        shared embedding server instead of a model loaded in this process.
+        """
+        server_url = server_url or os.environ.get('EMBEDDING_SERVER_URL')
+        if server_url:
+            self.model_embedder = RemoteEmbeddings(server_url, legal=legal)
+        else:
+            self.model_embedder = ModelEmbeddings(legal=legal, backend=backend)
         self.embedding_size = self.model_embedder.embedding_size
+        self.cache = get_cache(cache_path)
         logger.info(
             f"Embedder initialized with {'Legal' if legal else 'General'} model "
             f"and embedding size: {self.embedding_size}"
         )
 
-    def get_embedding(self, text: str) -> List[float]:
-        embedding = self.model_embedder.embed_query(text)
+    def get_embedding(self, text: str) -> np.ndarray:
+        embedding = self.get_embeddings([text])[0]
         if len(embedding) != self.embedding_size:
             logger.warning(
                 f"Unexpected embedding size for text: {text[:50]}..."
             )
         return embedding
 
-    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
-        return self.model_embedder.get_embeddings(texts)
-
-
-class Chunker:
+    def get_embeddings(self, texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE) -> np.ndarray:
+        """
+        Embed `texts` into a (len(texts), embedding_size) float32 array,
+        serving cached vectors and sending only the misses to the model.
+        """
+        if self.cache is None:
+            return self.model_embedder.get_embeddings(texts, batch_size=batch_size)
+
+        model_name = self.model_embedder.model_version
+        vectors = self.cache.get_many(model_name, texts)
+        misses = [text for text in dict.fromkeys(texts) if text not in vectors]
+        if misses:
+            computed = self.model_embedder.get_embeddings(misses, batch_size=batch_size)
+            vectors.update(zip(misses, computed))
+            # Zero vectors are the model's error fallback and must not be cached
+            self.cache.put_many(model_name, {
+                text: vector for text, vector in zip(misses, computed) if vector.any()})
+
+        embeddings = np.zeros((len(texts), self.embedding_size), dtype=np.float32)
+        for i, text in enumerate(texts):
+            embeddings[i] = vectors[text]
+        return embeddings
+
+    def cache_stats(self) -> Dict:
+        return self.cache.stats() if self.cache is not None else {}
+
+
+class SentenceSplitter:
+    """
+    Reading, sentence segmentation and grouping of sentences into chunk texts.
+    Loads no embedding or entity model, so it is cheap to build in worker processes.
+    """
     _instance = None
 
-    @staticmethod
-    def get_instance():
-        if Chunker._instance is None:
-            Chunker._instance = Chunker()
-        return Chunker._instance
-
-    def __init__(self, max_chunk_size=72):
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, segmentation: str = 'lean', chunking: str = 'tokens', max_chunk_size: int = MAX_CHUNK_TOKENS,
+                 overlap_tokens: int = 0, tokenizer_name: str = LEGAL_MODEL_NAME):
+        """
+        `segmentation='lean'` builds a blank Italian tokenizer with only the
+        sentencizer and the custom rules; 'full' runs the whole it_core_news_sm
+        pipeline (tagger, parser, NER) as well.
+
+        `chunking='tokens'` packs consecutive sentences into chunks of up to
+        `max_chunk_size` tokens of the embedding model's tokenizer, repeating
+        up to `overlap_tokens` tokens of trailing sentences at the start of
+        the next chunk; 'sentences' groups a fixed number of sentences.
+        """
+        if segmentation not in ('lean', 'full'):
+            raise ValueError(f"Unknown segmentation mode: {segmentation}")
+        if chunking not in ('tokens', 'sentences'):
+            raise ValueError(f"Unknown chunking mode: {chunking}")
+        if overlap_tokens >= max_chunk_size:
+            raise ValueError("overlap_tokens must be smaller than max_chunk_size")
+        self.segmentation = segmentation
+        if segmentation == 'lean':
+            self.nlp = spacy.blank('it')
+        else:
+            self.nlp = spacy.load('it_core_news_sm')
+        self.chunking = chunking
         self.max_chunk_size = max_chunk_size
-        self.entity_extractor = EntityExtractor.get_instance()
-        self.nlp = spacy.load('it_core_news_sm')
-        self.embedder = Embedder()
+        self.overlap_tokens = overlap_tokens
+        self.tokenizer_name = tokenizer_name
+        self._tokenizer = None
         self.max_sentences_per_chunk = 2
+        self.abbreviations = ABBREVIATIONS
 
-        # Custom abbreviations for Italian
-
-        self.abbreviations = set([
-            'art', 'dr', 'dott', 'prof', 'ing', 'arch', 'avv', 'sig', 'st', 'ss',
-
-            'v', 'vs', 'etc', 'ecc', 'es', 'pag', 'n', 'nr', 'fig', 'tab', 'ibid',
-
-            'cap', 'cit', 'op', 'cf', 'ca', 'max', 'min', 'ab', 'ad', 'al', 'c', ':', 'S.p',
-
-            'd', 'f', 'h', 'i', 'l', 'm', 'o', 'p', 'q', 'r', 's', 't', 'u', 'x', '1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12', '13', '14', '15', '16', '(', 'ac', 'ad', 'all', 'Amn', 'Arch', 'Avv', 'Bcc', 'CA', 'ca', 'CAP', 'CAP', 'Cc', 'c/c banc', 'c/c post', 'ccp', 'Chiamo', 'cm', 'c/o', 'Co', 'cp', 'CP', 'Cpr', 'Cso', 'corr', 'cs', 'cv', 'Dott', 'Dottssa', 'Dr', 'ecc', 'Egr', 'Egri', 'Egria', 'epc', 'fatt', 'Flli', 'Gentmo', 'Gentmi', 'Gentma', 'Gentme', 'Geom', 'g', 'gg', 'Id', 'Illmo', 'Ing', 'int', 'lett', 'Mo', 'Mons', 'NB', 'N/', 'ns', 'n°', 'n', 'ogg', 'on', 'p', 'pag', 'p', 'pp', 'pc', 'pc', 'pcc', 'pes', 'pf', 'pr', 'PS', 'pv', 'Pza', 'PT', 'Pregmo', 'Profssa', 'Prof', 'R', 'racc', 'Rag', 'Rev',
-
-            'ric', 'Rif', 'RP', 'RSVP', 'SA', 'S acc', 'SBF', 'S E & O', 'seg', 'sgg', 'ss', 'Sig', 'Sigg', 'Signa', 'Sigra', 'Sigra/signa', 'snc', 'Soc', 'SpA', 'Spett', 'SPM', 'Srl', 'Stimmo', 'tel', 'us', 'V', 'V/', 'vs', 'Vip', 'Vle', 'VP', 'vr', 'vs', 'AAS', 'ABGB', 'abr', 'acc', 'al', 'all', 'art', 'ASS', 'Atti parl Cam', 'Atti parl Sen', 'Aue',
-
-            'BUAbr', 'BUBasil', 'BUCal', 'BUCamp', 'BUEmRom', 'BUFVG', 'BULazio', 'BULig', 'BULomb', 'BUMarche', 'BUMol', 'BUPiem', 'BUPuglia', 'BUSar', 'BUTAA', 'BUTosc', 'BUUmbria', 'BUVdA', 'BUVen', 'Bull off', 'C', 'can', 'cap', 'cc', 'cceo', 'cc fr', 'c comm', 'c comm fr', 'CdM', 'Cedu', 'cic', 'circ', 'c nav', 'co', 'conc', 'conv', 'convenz', 'cost', 'cp', 'cpc', 'cpc fr', 'cp fr', 'cpmilg', 'cpmilp', 'cpp', 'cpp fr', 'cpv', 'D', 'dCG', 'dCpS', 'dec', 'dec Ceca', 'dec Cee', 'dec Ce', 'del', 'd interm', 'dir', 'dir Ceca', 'dir Cee', 'dir Ce', 'disp att', 'disp att coord', 'disp coord', 'disp prel', 'disp trans', 'dl', 'dlg', 'dlg CpS', 'dlg lt', 'dlg PC', 'dlg PR', 'dl lt', 'dlt', 'dm', 'doc', 'dPC', 'dPR', 'd ric amm', 'GU', 'GUCE', 'GUSic',
-
-            'lin', 'l lav pa', 'l miner', 'l proc', 'l prov B', 'l prov T', 'l rg', 'l tar', 'm', 'mod', 'OR', 'ord giud', 'ord giur amm', 'prot', 'rd', 'rdl', 'rd lg', 'reg', 'reg ass benef', 'reg brev', 'reg Ceca', 'reg Cee', 'reg Ce', 'reg c nav', 'reg com prov', 'reg cont', 'reg esec', 'reg nav aerea', 'reg proc C conti', 'reg ps', 'reg rg', 'rel', 'st', 'tab', 'tit', 'tr', 'tr Ce', 'tr Ceca', 'tu', 'tu acque pubbl', 'tu avv St', 'tu b cult', 'tu C conti', 'tu com prov 1915', 'tu com prov 1934', 'tu Cons St', 'tu doc amm', 'tu edil', 'tu espr pu', 'tu fin loc', 'tu immigr', 'tu imp civ St', 'tu imp dr 1986', 'tu inf lav', 'tu pensioni', 'tu ps', 'vig', 'abr', 'arg', 'c', 'cap', 'cd', 'cfr', 'cit', 'conf', 'diff', 'ed', 'ined', 'lb', 'loc', 'lett', 'n', 'nt', 'op', 'p', 'pt', 'pt g', 'pt s', 'rist', 'rubr', 's ss', 'sd', 'sl', 'sess', 'sez', 'sr', 'suppl', 't', 'ult', 'v', 'vig', '§', 'App', 'App mil', 'Ass', 'Ass app', 'Cass', 'C conti', 'C cost', 'C eur du', 'C giust Ceca', 'C giust Ce', 'CIJ', 'Comm brevetti', 'Comm centr imp', 'Comm ed pop', 'Comm tribut 1o', 'Comm tribut 2o', 'Comm tribut centr', 'Cons reg sic', 'Cons St', 'CPJI', 'C reg sic', 'Gpa', 'Pret',
-
-            'Tar', 'Trib', 'Trib acque', 'Trib Ce', 'Trib mil', 'Trib sup acque', 'Trib supr mil', 'D disc pen', 'D disc priv', 'D disc pubbl', 'DI', 'Enc Br', 'Enc Dalloz civ', 'Enc Dalloz comm', 'Enc Dalloz crim', 'Enc Dalloz intern', 'Enc Dalloz proc civ', 'Enc Dalloz publ', 'Enc Dalloz soc trav', 'Enc dir', 'Enc giur', 'Enc giur it', 'Enc it', 'NDI', 'N rép Dalloz', 'Nss DI', 'Rép Dalloz', 'Tr dir amm eur', 'Trattato Orlando', 'Acque bon costr', 'Adl', 'Adm Law Rev', 'Adm publ', 'Adm Soc', 'Aff esteri', 'Aff soc internaz', 'Agg soc', 'Agr it', 'Ambiente', 'Am journ compar Law', 'Amm civ', 'Amm giud', 'Ammin', 'Ann Bari', 'Ann Camerino', 'Ann Catania', 'Ann dir intern', 'Ann Ferrara', 'Ann Genova', 'Ann Macerata', 'Ann Messina', 'Ann Palermo', 'Ann Perugia', 'Ann pi', 'Ann Rev Pol Sc', 'Ann sem Palermo', 'Ann stor dir', 'Ann triestini', 'Ann dir comp', 'Anr inst dr intern', 'App urb edil',
-
-            'Arch civ', 'Arch dir eccl', 'Arch dir pubbl', 'Arch fin', 'Arch giur', 'Arch giur circ', 'Arch giur op pubbl', 'Arch loc', 'Arch nuova proc pen', 'Arch pen', 'Arch ph dr', 'Arch resp civ', 'Arch ric giur', 'Arch st corp', 'Arch stor it', 'Arch ven', 'Asi', 'Assic', 'Assist soc', 'Azienda pubbl', 'Azienditalia', 'Banca borsa', 'Banca borsa tit cred', 'Banca cred', 'Banca impr soc', 'Boll ass cass risp', 'Boll ass it dir maritt', 'Boll cost parl', 'Boll for', 'Boll legisl tecn', 'Boll tribut', 'Br intern Law', 'Bull soc leg comp', 'Cahiers dr europ', 'Cal giud', 'Can Bar Rev', 'Carte stor', 'Cass pen', 'Cass pen mass', 'CIJ Recueil', 'Circ trasp', 'Civ catt', 'Comm Market Rep', 'Comm Market Rev', 'Comp stat it', 'Comuni dIt', 'Comun intern', 'Contr', 'Contr impr', 'Contr impr eur', 'Controllo legale conti', 'Corr trib', 'Corr giur', 'Crit dir', 'Crit econ', 'Crit pen', 'Crit pol', 'Crit soc', 'Crit sociol', 'Danno resp', 'D&G', 'Dem dir', 'Dif contr', 'Dir amm', 'Dir aut', 'Dir autom', 'Dir banca mercato fin', 'Dir b pubbl', 'Dir comm', 'Dir commercio intern', 'Dir comunit scambi intern', 'Dir eccl', 'Dir ed econ', 'Dir econ assic', 'Dir fall', 'Dir gest ambiente', 'Dir giur', 'Dir giur agr amb', 'Dir immigraz cittadinanza', 'Dir ind', 'Dir intern', 'Dir intern bell', 'Dir lav', 'Dir merc lav', 'Dir militare', 'Dir pen processo', 'Dir prat assic', 'Dir prat comm', 'Dir prat lav', 'Diritto prat soc', 'Dir prat tribut', 'Dir priv', 'Dir proc amm', 'Dir pubbl', 'Dir pubbl comp eur', 'Dir pubbl reg', 'Dir relaz ind', 'Dir san', 'Dir soc', 'Dir trasp', 'Dir Ue', 'Disciplina comm', 'DL Riv critica dir lav', 'Doc it', 'Dr adm', 'Dr inform tel', 'Droits', 'DVerw', 'Econ ambiente', 'Econ cultura', 'Econ intern', 'Econ dir terz', 'Econ intern en', 'Econ it', 'Econ pubbl', 'Ed cred', 'Ed terr', 'Enc com', 'Energia', 'Enti pubbl', 'Es imp dir fisc', 'EDCE', 'ER',
-
-            'Europa dir priv', 'Eur Competition Law Rev', 'Eur Law J', 'Eur Law Rev', 'Eur Leg For', 'Fin loc', 'Fordham Intern Law J', 'Foro ambr', 'Foro amm Tar', 'Foro it', 'Foro nap', 'Foro Sal', 'Foro tosc', 'Funz pubbl', 'Gazz ambiente', 'Gazz giur', 'Gazz loc', 'Gazz tribut', 'Giorn dir amm', 'Giorn dir lav rel ind', 'Giorn stor cost', 'Giur agr it', 'Giur annotata dir ind', 'Giur boll legisl tecn', 'Giur comm', 'Giur comp dir civ', 'Giur compl cass civ', 'Giur compl cass pen', 'Giur Corti reg', 'Giur cost', 'Giur imp', 'Giur imp dr', 'Giur imp dr reg neg', 'Giur infort', 'Giur it', 'Giur lav', 'Giur merito', 'Giur milanese', 'Giur napoletana', 'Giur op pubbl', 'Giur piemontese', 'Giur romana', 'Giur samm', 'Giur sic', 'Giur tor', 'Giur tosc', 'Gius', 'Giust', 'Giust amm', 'Giust amm sic', 'Giust autom', 'Giust civ', 'Giust civ mass app', 'Giust civ Mass', 'Giust Cost', 'Giust fin', 'Giustit', 'Giust pen', 'Gov', 'GT riv giur trib', 'Guida dir', 'Guida el', 'Guida lav', 'Harv Intern Law J', 'Harv Law Rev', 'Hastings Intern Comp Law Rev', 'Hist J', 'Ig sic lav', 'Imp cons entr', 'Impos dr', 'Industria', 'Ind sind', 'Informatica dir', 'Informatica doc', 'Informaz previd', 'Inf tribut comm', 'Intern Law Pol', 'Intern Law Quart', 'Intern Law Rev', 'Intern Leg Mat', 'Intern J Soc Law', 'Intern Org', 'Ist federalismo', 'J dr intern', 'J dr intern priv', 'J eur Verw', 'J intern ausl öff R', 'J öff R', 'J Comm Market St', 'J Econ Liter', 'J Env Law', 'J Eur Publ Pol', 'J Inst Th Econ', 'J Leg St', 'J Pubbl Pol', 'Lav dir', 'Lav nella giur', 'Lav prev oggi', 'Lav rel ind', 'Lav sicur soc', 'Law Pol', 'Leg it',
-
-            'Leg pen', 'Leg St', 'Mass Ced', 'Mass dec pen', 'Mass giur it', 'giur', 'it', 'Mass giur lav', 'Mass Pen', 'Mass tribut', 'Mass trib supr mil', 'Mat stor cultura giur', 'MCR', 'Meridiana', 'Min it', 'Mn cred', 'Mom leg', 'Mon eccl', 'Mon pret', 'Mon trib', 'Mondo banc', 'Mondo giud', 'N arch ven', 'N dir', 'N dir agr', 'N leg pen', 'Nomos', 'Nord sud', 'Not giur lav', 'Not giur reg', 'Not fall', 'Not lav prev', 'N rass amm com', 'N rass ldg', 'N giur civ commentata', 'N riv app', 'N riv dir comm', 'N riv tribut', 'Nuove leggi civili', 'Or econ', 'Orient giur lav', 'Oss leg', 'Parl Aff', 'Pitts LR', 'Polis', 'Pol', 'Pol dir', 'Pol man publ', 'Pol Q', 'Pol parl', 'Pol Sc', 'Pol St', 'Poste tel', 'Pouvoirs', 'PQM', 'Prat az', 'Prevenz infort', 'Prev soc', 'Prev soc agr', 'PSQ', 'Prob amm pubbl', 'Prob Inf', 'Publ Adm', 'Publ Adm Dev', 'Publ Adm Rev', 'Publ Choice', 'Publ Law', 'Publ Pol Adm', 'Quad amm', 'Quad cost', 'Quad dir lav rel ind', 'Quad fior stor', 'Quad min fin', 'Quad reg', 'Quad sc pol', 'Racc Cons St', 'Racc giur C giust', 'Ragiufarm', 'Ragiusan', 'Rass amm sanita', 'Rass amm scuola', 'Rass arch St', 'Rass avv Napoli', 'Rass Avv St', 'Rass circ str', 'Rass dir cinem', 'Rass dir civ', 'Rass dir dog', 'Rass dir eccl', 'Rass dir farm', 'Rass dir pubbl', 'Rass dir san', 'Rass econ', 'Rass fin pubbl', 'Rass fin tribut', 'Rass forense', 'Rass giur Enel', 'Rass giur en elettr', 'Rass giur ist st leg', 'Rass giur s', 'Rass giur u', 'Rass giust mil', 'Rass imp dr', 'Rass lav', 'Rass lav pubbl', 'Rass parl', 'Rass penit crim', 'Rass penit criminol', 'Rass propr ila', 'Rass stat lav', 'Rass st penit', 'Rass tribut', 'Reg', 'Rel intern', 'Resp civ prev', 'Resp comunic impr', 'Rev adm publica', 'Rev der com eur', 'Rev es der adm', 'Rev esp der intern', 'Rev adm', 'Rev adm publ', 'Rev affaires europe´ennes', 'Rev crit dr intern priv', 'Rev dr intern dr comp', 'Rev dr intern leg comp', 'Rev dr intern sc dipl pol', 'Rev dr publ', 'Rev dr Ue', 'Rev eur dr publ', 'Rev fr adm publ', 'Rev fr dr adm', 'Rev fr sc pol', 'Rev ge´n dr', 'Rev ge´n dr intern', 'Rev hist dr fr', 'Rev intern dr comp', 'Rev intern sc adm', 'Rev MCUE', 'Rev MUE', 'Rev pol parl', 'Rev trim dr civ', 'Rev trim dr comm', 'Rev trim dr europ', 'Rev trim dr homme',
-
-            'RHD', 'Riv Ag terr', 'Riv amm', 'Riv amm app', 'Riv arbitrato', 'Riv banc', 'Riv cass risp', 'Riv cat', 'Riv C conti', 'Riv coop', 'Riv crit dir giur', 'Riv crit dir priv', 'Riv crit infort lav', 'Riv dem', 'Riv dif soc', 'Riv dip terr', 'Riv dir aer', 'Riv dir agr', 'Riv dir civ', 'Riv dir comm', 'Riv dir cost', 'Riv dir eur', 'Riv dir fin', 'Riv dir impresa', 'Riv dir ind', 'Riv dir intern', 'Riv dir intern comp lav', 'Riv dir intern priv proc', 'Riv dir ipot', 'Riv dir lav', 'Riv dir lav mass', 'Riv dir matr', 'Riv dir mil', 'Riv dir miner', 'Riv dir nav', 'Riv dir penit', 'Riv dir priv', 'Riv dir proc', 'Riv dir proc civ', 'Riv dir proc pen', 'Riv dir pubbl', 'Riv dir sic soc', 'Riv dir sport', 'Riv dir tribut', 'Riv dott comm', 'Riv econ Mezz', 'Riv es forz', 'Riv fil', 'Riv fisc', 'Riv giur ambiente', 'Riv giur circ trasp', 'Riv giur edil', 'Riv giur lav', 'Riv giur magistr', 'Riv giur Mezz', 'Riv giur polizia', 'Uff', 'Vol', 'PQM', 'nr', 'est', 'cf', 'segg', 'sigg ri', 'tg', 'PM', 'cpa', 'iva', 'loc', 'cp c', 'cod proc civ', 'gd', 'sp', 'Disp Att', 'GIP', 'GUP', 'CC', 'CPC', 'CP', 'CPP', 'pubbl', 'ar', 'ab', 'ab km²', 'ab kmq', 'abbigl', 'abbrev', 'abl', 'aC', 'ac', 'acc', 'accorc', 'accr', 'adatt', 'adr', 'aeron', 'aerodin', 'affl', 'agg', 'agr', 'agric', 'alch', 'alg', 'alim', 'allev', 'allus', 'alt',
-
-            'anat', 'anat comp', 'ant', 'antifr', 'anton', 'antrop', 'ar', 'arald', 'arc', 'arch', 'archeol', 'aritm', 'arred', 'art', 'arti min', 'artig', 'artigl', 'artt', 'assic', 'assol', 'astr', 'astrol', 'astron', 'att', 'attrav', 'aus', 'autom', 'avv', 'avvers', 'bal', 'ball', 'batt', 'bibl', 'bioch', 'biol', 'bot', 'bur', 'ca', 'cal', 'cap', 'capol', 'card', 'caus', 'ca', 'cm', 'cd', 'cd', 'a', 'centr', 'cfr', 'chim', 'chim ind', 'chir', 'ciber', 'cin', 'citol', 'class', 'cm²', 'cmq', 'cod civ',
-
-            'enol', 'entom', 'epigr', 'es', 'escl', 'estens', 'estr min', 'etim', 'etn', 'etol', 'eufem', 'fam', 'farm', 'ferr', 'fig', 'filat', 'filol', 'filos', 'fin', 'fis', 'fisiol', 'fisiopatol', 'folcl', 'fon', 'fotogr', 'fr', 'fut', 'gen', 'geneal', 'geod', 'geofis', 'geogr', 'geogr antr', 'geogr fis', 'geol', 'geom', 'germ', 'giorn', 'gr', 'gram', 'ibid', 'icon', 'id', 'idraul', 'ig', 'imp', 'imper', 'imperf', 'impers', 'ind', 'ind agr', 'ind alim', 'ind cart', 'ind chim', 'ind cuoio', 'ind estratt', 'ind graf', 'ind mecc', 'ind tess', 'indecl', 'indef', 'indeterm', 'inf', 'inform', 'ing', 'ingl', 'ins', 'inter', 'intr', 'invar', 'iron', 'irreg', 'is', 'istol', 'it', 'ittiol', 'lat', 'lav femm', 'lav pubbl', 'lett', 'ling', 'lit', 'loc', 'loc div', 'long', 'macch', 'mar', 'mat', 'mater', 'max', 'mecc', 'med', 'mediev', 'merc', 'merid', 'metall', 'meteor', 'metr', 'metrol', 'microb', 'mil', 'min', 'miner', 'mitol', 'mod', 'morf', 'mss', 'mus', 'na', 'neg', 'neol', 'neur', 'nom', 'numism', 'oc', 'occ', 'occult', 'oculist', 'od', 'ogg', 'oland', 'onomat', 'ord', 'ord scol', 'oref', 'orient', 'ornit', 'orogr', 'ott', 'pa', 'pag', 'pagg', 'paleobot', 'paleogr', 'paleont', 'paleozool', 'paletn', 'papir', 'parapsicol', 'part', 'partic', 'pass', 'patol', 'pedag', 'pegg', 'per ind', 'pers',
-
-            'petr', 'petrogr', 'pitt', ' D.Lgs', 'pl', 'poet', 'pol', 'popol', 'port', 'poss', 'pr', 'pref', 'preist', 'prep', 'pres', 'pret', 'priv', 'prof', 'pron', 'pronom', 'propr', 'prov', 'prox', 'psicoan', 'psicol', 'qc', 'qlc', 'qlcn', 'qlco', 'qlcs', 'qlcu', 'qualif', 'radiotecn', 'rag', 'rar', 'recipr', 'reg', 'region', 'rel', 'rem', 'rep', 'retor', 'rifl', 'rit', 'rom', 'scherz', 'scien', 'scult', 'sec', 'secc', 'seg', 'segg', 'sigill', 'sig', 'sigg', 'sig ra', 'sig na', 'simb', 'sin', 'sing', 's/m', 'sociol', 'sogg', 'sp', 'spett', 'spreg', 'st', 'stat', 'st d arte', 'st d dir', 'st d filos', 'st d rel', 'suff', 'sup', 'superl', 'tav', 'tecn', 'tecnol', 'ted', 'tel', 'telecom', 'temp', 'teol', 'term', 'tess', 'tipogr', 'top', 'topog', 'tosc', 'tr', 'trad', 'trasp', 'ungh', 'urban', 'val', 'vd', 'veter', 'vezz', 'voc', 'vol', 'volg', 'voll', 'zool', 'zoot', 'disp att cc', 'succ mod', 'ss mm ii', 'co', 'D Lgs', 'cd', 'sez un', 'sent', 'nn', 't a r', 'rv', 'ric n', 'fall', 'l c a', 't u b', 'Cass civ'
-        ])
-
-        
         self.add_custom_rules(self.nlp)
 
     def tokenize(self, text: str, min_token: int) -> List[str]:
@@ -151,26 +368,25 @@ class Chunker:
 
         return italian_words
 
-    def extract_entities(self, text):
-        return self.entity_extractor.extract_entities(text)
-
     def add_custom_rules(self, nlp):
         for abbr in self.abbreviations:
             nlp.tokenizer.add_special_case(abbr + '.', [{'ORTH': abbr + '.'}])
 
         if 'sentencizer' not in nlp.pipe_names:
-            nlp.add_pipe('sentencizer', before='parser')
+            if 'parser' in nlp.pipe_names:
+                nlp.add_pipe('sentencizer', before='parser')
+            else:
+                nlp.add_pipe('sentencizer')
 
         nlp.add_pipe('custom_sentence_segmentation', after='sentencizer')
 
     @staticmethod
     @Language.component("custom_sentence_segmentation")
     def custom_sentence_segmentation(doc):
-        abbreviations = Chunker.get_instance().abbreviations
         for token in doc[:-1]:
-            if token.text.lower().rstrip('.') in abbreviations:
+            if token.lower_.rstrip('.') in ABBREVIATION_LOOKUP:
                 token.nbor(1).is_sent_start = False
-            elif re.match(r'^\d+\.$', token.text) and token.i + 1 < len(doc):
+            elif NUMBERED_ITEM.match(token.text) and token.i + 1 < len(doc):
                 # Check if it's a numbered list item
                 next_token = doc[token.i + 1]
                 if next_token.is_alpha and next_token.is_title:
@@ -205,11 +421,7 @@ class Chunker:
         return text
 
     def read_pdf(self, doc_location):
-        text = ""
-        with fitz.open(doc_location) as doc:
-            for page in doc:
-                text += page.get_text()
-        return text
+        return ''.join(text for _, text in self.iter_pages(doc_location))
 
     def read_text(self, doc_location):
         try:
@@ -219,6 +431,71 @@ class Chunker:
             with open(doc_location, 'r', encoding='iso-8859-1') as file:
                 return file.read()
 
+    def iter_pages(self, doc_location) -> Iterator[Tuple[int, str]]:
+        """Yield (page_number, text) lazily; non-PDF files are a single page 1."""
+        _, file_extension = os.path.splitext(doc_location)
+        if file_extension.lower() != '.pdf':
+            yield 1, self.read_text(doc_location)
+            return
+
+        with fitz.open(doc_location) as doc:
+            for page in doc:
+                yield page.number + 1, page.get_text()
+
+    def _segment_window(self, window: List[Tuple[int, str]], final: bool):
+        """
+        Split a window of (page_number, text) pieces into (sentence, page)
+        pairs. Unless `final`, the last sentence may continue past the window
+        and is returned, as pieces, to be carried into the next one.
+        """
+        text, starts, numbers = '', [], []
+        for number, piece in window:
+            starts.append(len(text))
+            numbers.append(number)
+            text += piece
+
+        def page_at(offset):
+            return numbers[bisect.bisect_right(starts, offset) - 1]
+
+        sents = list(self.nlp(text).sents)
+        carry = []
+        if not final and len(sents) > 1:
+            cut = sents.pop().start_char
+            for start, (number, piece) in zip(starts, window):
+                if start + len(piece) > cut:
+                    carry.append((number, piece[max(cut - start, 0):]))
+
+        sentences = [(sent.text.strip(), page_at(sent.start_char))
+                     for sent in sents if sent.text.strip()]
+        return sentences, carry
+
+    def iter_sentences(self, doc_location, window_pages: int = PAGE_WINDOW) -> Iterator[Tuple[str, int]]:
+        """
+        Stream (sentence, page_number) pairs, segmenting `window_pages` pages at
+        a time so memory depends on the window rather than the document. The
+        last sentence of each window is carried over and segmented again with
+        the following pages, so sentences spanning a page break stay whole.
+        """
+        pages = self.iter_pages(doc_location)
+        carry = []
+        found = False
+        while True:
+            new_pages = list(itertools.islice(pages, window_pages))
+            final = len(new_pages) < window_pages
+            window = carry + new_pages
+            if not window:
+                break
+
+            sentences, carry = self._segment_window(window, final)
+            for sentence in sentences:
+                found = True
+                yield sentence
+            if final:
+                break
+
+        if not found:
+            raise ValueError(f"The document {doc_location} is empty.")
+
     def split_into_sentences(self, text):
         doc = self.nlp(text)
         sentences = [sent.text.strip() for sent in doc.sents]
@@ -228,44 +505,220 @@ class Chunker:
 
         return sentences
 
-    def chunk_text(self, doc_location: str) -> List[Dict]:
+    @property
+    def splitter_options(self) -> Dict:
+        """Constructor arguments that reproduce this splitter's chunk texts in another process."""
+        return {
+            'segmentation': self.segmentation,
+            'chunking': self.chunking,
+            'max_chunk_size': self.max_chunk_size,
+            'overlap_tokens': self.overlap_tokens,
+            'tokenizer_name': self.tokenizer_name
+        }
+
+    @property
+    def tokenizer(self):
+        # Only the tokenizer is loaded, not the model, so workers stay light
+        if self._tokenizer is None:
+            self._tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
+        return self._tokenizer
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer(text, add_special_tokens=False)['input_ids'])
+
+    def build_chunk_texts(self, sentences: Iterable[Tuple[str, int]]) -> Iterator[Tuple[str, int, int]]:
+        """Group (sentence, page) pairs into (chunk_text, page_start, page_end)."""
+        if self.chunking == 'tokens':
+            return self._pack_by_tokens(sentences)
+        return self._group_by_sentences(sentences)
+
+    def _pack_by_tokens(self, sentences: Iterable[Tuple[str, int]]) -> Iterator[Tuple[str, int, int]]:
+        """
+        Pack consecutive sentences while they fit in `max_chunk_size` tokens.
+        A sentence longer than the budget becomes a chunk on its own.
+        """
+        group, tokens = [], 0
+        for text, page in sentences:
+            count = self.count_tokens(text)
+            if group and tokens + count > self.max_chunk_size:
+                yield ' '.join(t for t, _, _ in group), group[0][1], group[-1][1]
+
+                overlap, overlap_count = [], 0
+                for item in reversed(group[1:]):
+                    if overlap_count + item[2] > self.overlap_tokens:
+                        break
+                    overlap.insert(0, item)
+                    overlap_count += item[2]
+                if overlap_count + count > self.max_chunk_size:
+                    overlap, overlap_count = [], 0
+                group, tokens = overlap, overlap_count
+
+            group.append((text, page, count))
+            tokens += count
+        if group:
+            yield ' '.join(t for t, _, _ in group), group[0][1], group[-1][1]
+
+    def _group_by_sentences(self, sentences: Iterable[Tuple[str, int]]) -> Iterator[Tuple[str, int, int]]:
+        group = []
+        for sentence in sentences:
+            group.append(sentence)
+            if len(group) == self.max_sentences_per_chunk:
+                yield ' '.join(text for text, _ in group), group[0][1], group[-1][1]
+                group = []
+        if group:
+            yield ' '.join(text for text, _ in group), group[0][1], group[-1][1]
+
+    def iter_chunk_texts(self, doc_location: str) -> Iterator[Tuple[str, int, int]]:
+        """Stream (chunk_text, page_start, page_end) as pages are read."""
+        return self.build_chunk_texts(self.iter_sentences(doc_location))
+
+    def prepare_chunk_texts(self, doc_location: str) -> List[Tuple[str, int, int]]:
         logger.info(f"Starting to chunk document: {doc_location}")
 
-        text = self.read_file(doc_location)
-        logger.info(f"Extracted text length: {len(text)}")
-        logger.debug(f"First 200 characters of extracted text: {text[:200]}")
-
-        sentences = self.split_into_sentences(text)
-        logger.info(f"Number of sentences: {len(sentences)}")
-
-        sentences = [s for s in sentences if s.strip()]
-
-        if not sentences:
-            logger.warning(
-                f"No valid sentences found in document: {doc_location}")
-            return []
-
-        chunks = []
-        i = 0
-        total_sentences = len(sentences)
-        while i < total_sentences:
-            chunk_sentences = sentences[i:i + self.max_sentences_per_chunk]
-            chunk_text = ' '.join(chunk_sentences)
-
-            entities = self.extract_entities(chunk_text)
-
-            chunk_embedding = self.embedder.get_embedding(chunk_text)
+        chunk_texts = list(self.iter_chunk_texts(doc_location))
+        logger.info(f"Number of chunks: {len(chunk_texts)}")
+
+        return chunk_texts
+
+
+def check_backend_parity(backend: str = 'onnx-int8', legal: bool = True, texts: List[str] = None,
+                         min_similarity: float = 0.99) -> Dict:
+    """
+    Embed `texts` with the PyTorch backend and with `backend` and compare the
+    vectors by cosine similarity. Also reports the time each backend took.
+    """
+    texts = texts or PARITY_TEXTS
+    vectors, timings = {}, {}
+    for name in ('torch', backend):
+        model = ModelEmbeddings(legal=legal, backend=name)
+        started = time.perf_counter()
+        vectors[name] = np.asarray(model.get_embeddings(texts), dtype=np.float32)
+        timings[name] = time.perf_counter() - started
+
+    reference, candidate = vectors['torch'], vectors[backend]
+    similarities = (reference * candidate).sum(1) / np.maximum(
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1), 1e-12)
+    report = {
+        'backend': backend,
+        'min_similarity': float(similarities.min()),
+        'mean_similarity': float(similarities.mean()),
+        'seconds': timings,
+        'passed': bool(similarities.min() >= min_similarity)
+    }
+    logger.info(f"Backend parity: {report}")
+    return report
+
+
+_splitters = {}
+
+
+def prepare_document(doc_location: str, options: Dict = None):
+    """
+    Process-pool entry point: read and split one document into chunk texts.
+    `options` are the parent's `splitter_options`, so workers chunk exactly
+    like the parent's Chunker; one splitter is kept per process and options.
+    """
+    key = tuple(sorted((options or {}).items()))
+    if key not in _splitters:
+        _splitters[key] = SentenceSplitter(**(options or {}))
+    return doc_location, _splitters[key].prepare_chunk_texts(doc_location)
+
+
+class Chunker(SentenceSplitter):
+    _instance = None
 
-            chunks.append({
+    def __init__(self, max_chunk_size=MAX_CHUNK_TOKENS, embedding_batch_size=EMBEDDING_BATCH_SIZE, segmentation='lean',
+                 chunking='tokens', overlap_tokens=0):
+        super().__init__(segmentation, chunking, max_chunk_size, overlap_tokens)
+        self.embedding_batch_size = embedding_batch_size
+
+    @property
+    def entity_extractor(self) -> EntityExtractor:
+        return registry.get_entity_extractor()
+
+    @property
+    def embedder(self) -> Embedder:
+        return registry.get_embedder(legal=True)
+
+    @property
+    def settings(self) -> Dict:
+        """Model versions and chunking parameters that determine the chunks produced."""
+        return {
+            # What actually embeds: in server mode the server's model and backend
+            'embedding_model': self.embedder.model_embedder.model_version,
+            'entity_model': EntityExtractor.MODEL_NAME,
+            'entity_label_sets': LABEL_SETS,
+            'max_sentences_per_chunk': self.max_sentences_per_chunk,
+            'segmentation': self.segmentation,
+            'chunking': self.chunking,
+            'max_chunk_tokens': self.max_chunk_size,
+            'overlap_tokens': self.overlap_tokens,
+            'tokenizer': self.tokenizer_name
+        }
+
+    def extract_entities(self, text, labels=None):
+        return self.entity_extractor.extract_entities(text, labels)
+
+    def enrich_chunks(self, chunk_texts: List[Tuple[str, int, int]], known_chunks: Dict[str, Dict] = None,
+                      labels: List[str] = None) -> List[Dict]:
+        """
+        Attach entities and embeddings to each (chunk_text, page_start,
+        page_end). Texts found in `known_chunks` (text -> previously computed
+        chunk) reuse its entities and embedding.
+        `labels` selects the entity labels to extract (default: all).
+        """
+        known_chunks = known_chunks or {}
+        # Repeated boilerplate chunks are embedded once
+        new_texts = list(dict.fromkeys(
+            text for text, _, _ in chunk_texts if text not in known_chunks))
+
+        embeddings = self.embedder.get_embeddings(
+            new_texts, batch_size=self.embedding_batch_size)
+
+        entities = self.entity_extractor.extract_entities_batch(new_texts, labels)
+
+        new_chunks = {}
+        for chunk_text, chunk_embedding, chunk_entities in zip(new_texts, embeddings, entities):
+            new_chunks[chunk_text] = {
                 'text': chunk_text,
                 'embedding': chunk_embedding,
-                'entities': entities
-            })
-
-            logger.debug(
-                f"Created chunk with {len(chunk_sentences)} sentences")
-            i += self.max_sentences_per_chunk
+                'entities': chunk_entities
+            }
+
+        return [dict(known_chunks.get(text) or new_chunks[text],
+                     page_start=page_start, page_end=page_end)
+                for text, page_start, page_end in chunk_texts]
+
+    def chunk_text(self, doc_location: str, known_chunks: Dict[str, Dict] = None, doc_type: str = None,
+                   batch_chunks: int = STREAM_BATCH_CHUNKS) -> Iterator[Dict]:
+        """
+        Stream enriched chunks of a document. Pages are read and segmented
+        lazily and every `batch_chunks` chunk texts are enriched and yielded,
+        so consumers can start writing before the file is fully read.
+        """
+        labels = labels_for(doc_type or infer_doc_type(doc_location))
+        chunk_texts = self.iter_chunk_texts(doc_location)
+
+        count = 0
+        while True:
+            batch = list(itertools.islice(chunk_texts, batch_chunks))
+            if not batch:
+                break
+            for chunk in self.enrich_chunks(batch, known_chunks, labels):
+                count += 1
+                yield chunk
 
         logger.info(
-            f"Created {len(chunks)} chunks for document: {doc_location}")
-        return chunks
+            f"Created {count} chunks for document: {doc_location}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Compare an embedding backend against PyTorch')
+    parser.add_argument('--backend', choices=['onnx', 'onnx-int8'], default='onnx-int8')
+    parser.add_argument('--general', action='store_true',
+                        help='Check the general model instead of the legal one')
+    args = parser.parse_args()
+
+    report = check_backend_parity(args.backend, legal=not args.general)
+    raise SystemExit(0 if report['passed'] else 1)
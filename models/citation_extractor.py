@@ -1,73 +1,337 @@
+import glob
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+import numpy as np
 import spacy
 from transformers import BertTokenizer, BertForSequenceClassification
 import torch
 
+# Texts per nlp.pipe batch for the citation NER model
+NER_BATCH_SIZE = 64
+# Texts per forward pass of the citation classifier
+CLASSIFY_BATCH_SIZE = 32
+
+# Cheap signs of a legal citation; texts matching none of them skip the NER model
+CITATION_CANDIDATE = re.compile(r"""
+      \bartt?\.\s*\d              # art. 1218, artt. 1175
+    | \barticol[oi]\b
+    | \bc\.\s?c\.                 # c.c.
+    | \bc\.\s?p\.                 # c.p., c.p.c., c.p.p.
+    | \bd\.\s?lgs\.?              # d.lgs.
+    | \bd\.\s?l\.                 # d.l.
+    | \bd\.\s?p\.\s?r\.            # d.p.r.
+    | \bd\.\s?m\.                 # d.m.
+    | \bl\.\s?(?:n\.\s?)?\d        # l. 392/1978, l. n. 40
+    | \bn\.\s?\d                  # Codice Civile n. 407
+    | \blegge\b
+    | \bcodice\b
+    | \bcost\.                   # Cost.
+    | \bdisp\.\s?att\.            # disp. att.
+    | \b\d+[-\s]?(?:bis|ter|quater|quinquies|sexies|septies|octies|novies|decies)\b
+    | §
+""", re.IGNORECASE | re.VERBOSE)
+
+
+def citation_candidates(text):
+    """Character spans of every citation candidate in `text`."""
+    return [match.span() for match in CITATION_CANDIDATE.finditer(text or "")]
+
+
+def gate_text(text, context_chars=None):
+    """
+    Return what the NER model should see for `text`: None when it has no
+    citation candidate, otherwise the whole text, or with `context_chars`
+    only the text within that many characters of a candidate, widened to
+    whitespace and with nearby windows merged.
+    """
+    spans = citation_candidates(text)
+    if not spans:
+        return None
+    if context_chars is None:
+        return text
+
+    windows = []
+    for start, end in spans:
+        start = max(0, start - context_chars)
+        end = min(len(text), end + context_chars)
+        while start > 0 and not text[start - 1].isspace():
+            start -= 1
+        while end < len(text) and not text[end].isspace():
+            end += 1
+        if windows and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], end))
+        else:
+            windows.append((start, end))
+    return "\n".join(text[start:end] for start, end in windows)
+
+
 class LegalCitationPipeline:
-    def __init__(self):
-        self.tokenizer = BertTokenizer.from_pretrained("models/outputs/")
-        self.classification_model = BertForSequenceClassification.from_pretrained("models/outputs/")
-        
+    def __init__(self, batch_size=NER_BATCH_SIZE, n_process=1, prefilter=True, context_chars=None):
+        """
+        With `prefilter`, texts without citation candidates skip the NER
+        model; with `context_chars` as well, only the text around the
+        candidates is sent to it. The BERT classifier is loaded on the first
+        classification, so NER-only use never loads it.
+        """
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self._tokenizer = None
+        self._classification_model = None
+        self._classifier_lock = threading.Lock()
+
         model_path = "models/ner_model/model-last"
         self.ner_model = spacy.load(model_path)
         
         self.max_length = 512
 
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.prefilter = prefilter
+        self.context_chars = context_chars
+        self.texts_processed = 0
+        self.texts_skipped = 0
+        self.citations_found = 0
+        self.seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _load_classifier(self):
+        with self._classifier_lock:
+            if self._classification_model is None:
+                self._tokenizer = BertTokenizer.from_pretrained("models/outputs/")
+                self._classification_model = BertForSequenceClassification.from_pretrained(
+                    "models/outputs/").to(self.device).eval()
+
+    @property
+    def tokenizer(self):
+        self._load_classifier()
+        return self._tokenizer
+
+    @property
+    def classification_model(self):
+        self._load_classifier()
+        return self._classification_model
+
     def classify_text(self, text):
-        encoded = self.tokenizer.encode_plus(
-            text,
-            max_length=self.max_length,
-            truncation=True,
-            padding='max_length',
-            return_tensors="pt"
-        )
-        
-        try:
-            with torch.no_grad():
-                outputs = self.classification_model(**encoded)
-                logits = outputs.logits
-                predicted_class = logits.argmax(dim=-1).item()
-            return predicted_class
-        except Exception as e:
-            print(f"Error in classification: {e}")
-            return 0  
+        return int(self.classify_batch([text])[0].argmax())
 
-    def process_text(self, text):
-        try:
-            doc = self.ner_model(text)
-
-            citations = []
-            current_doc = None
-            
-            entities = list(doc.ents)
-            
-            for i, ent in enumerate(entities):
-                if ent.label_ == "DOC":
-                    current_doc = ent.text
-                elif ent.label_ == "ART":
-                    if current_doc:
-                        citations.append((current_doc, ent.text))
-                    else:
-                        for next_ent in entities[i+1:]:
-                            if next_ent.label_ == "DOC":
-                                citations.append((next_ent.text, ent.text))
-                                break
+    def classify_batch(self, texts, batch_size=CLASSIFY_BATCH_SIZE):
+        """
+        Class probabilities for `texts` as a (len(texts), num_labels) float32
+        array. Texts are sorted by length and each batch is padded only to
+        its longest text; rows come back in input order.
+        """
+        num_labels = self.classification_model.config.num_labels
+        probabilities = np.zeros((len(texts), num_labels), dtype=np.float32)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i] or ""))
+
+        for start in range(0, len(order), batch_size):
+            batch_indices = order[start:start + batch_size]
+            try:
+                encoded = self.tokenizer(
+                    [texts[i] or "" for i in batch_indices],
+                    max_length=self.max_length,
+                    truncation=True,
+                    padding=True,
+                    return_tensors="pt"
+                ).to(self.device)
+                with torch.inference_mode():
+                    logits = self.classification_model(**encoded).logits
+                    probabilities[batch_indices] = torch.softmax(
+                        logits.float(), dim=-1).cpu().numpy()
+            except Exception as e:
+                print(f"Error in classification: {e}")
+                # Same fallback as before: class 0
+                probabilities[batch_indices, 0] = 1.0
+        return probabilities
+
+    def _citations(self, doc):
+        citations = []
+        current_doc = None
+
+        entities = list(doc.ents)
+
+        for i, ent in enumerate(entities):
+            if ent.label_ == "DOC":
+                current_doc = ent.text
+            elif ent.label_ == "ART":
+                if current_doc:
+                    citations.append((current_doc, ent.text))
+                else:
+                    for next_ent in entities[i+1:]:
+                        if next_ent.label_ == "DOC":
+                            citations.append((next_ent.text, ent.text))
+                            break
+
+        return citations
+
+    def _model_input(self, text, prefilter):
+        if not prefilter:
+            return text or ""
+        return gate_text(text, self.context_chars)
 
+    def process_text(self, text, prefilter=None):
+        prefilter = self.prefilter if prefilter is None else prefilter
+        try:
+            started = time.perf_counter()
+            model_input = self._model_input(text, prefilter)
+            if model_input is None:
+                self._count(1, 0, 0.0, skipped=1)
+                return []
+            citations = self._citations(self.ner_model(model_input))
+            self._count(1, len(citations), time.perf_counter() - started)
             return citations
-            
+
         except Exception as e:
             print(f"Error processing text: {e}")
             return []
 
-    def process_batch(self, texts):
-        results = []
-        for text in texts:
-            if text:  
+    def process_batch(self, texts, batch_size=None, n_process=None, prefilter=None):
+        """
+        Run the NER model over `texts` with nlp.pipe and yield the citations
+        of each text, in input order. `texts` may be any iterable, so results
+        stream while the input is still being produced. Empty texts, and with
+        `prefilter` texts without citation candidates, yield [] without
+        reaching the model.
+        """
+        batch_size = batch_size or self.batch_size
+        n_process = n_process or self.n_process
+        prefilter = self.prefilter if prefilter is None else prefilter
+
+        # One flag per input text, appended as nlp.pipe pulls the input:
+        # True if the text was sent to the model, False if it was skipped
+        sent = deque()
+
+        def model_inputs():
+            for text in texts:
+                model_input = self._model_input(text, prefilter)
+                sent.append(model_input is not None)
+                if model_input is not None:
+                    yield model_input
+
+        docs = self.ner_model.pipe(model_inputs(), batch_size=batch_size, n_process=n_process)
+        # Docs produced while pulling more input, not yet matched to their flag
+        ready = deque()
+
+        while True:
+            started = time.perf_counter()
+            if not sent:
+                doc = next(docs, None)
+                if doc is None and not sent:
+                    break
+                if doc is not None:
+                    ready.append(doc)
+                continue
+
+            if not sent.popleft():
+                self._count(1, 0, 0.0, skipped=1)
+                yield []
+                continue
+
+            doc = ready.popleft() if ready else next(docs)
+            try:
+                citations = self._citations(doc)
+            except Exception as e:
+                print(f"Error processing batch item: {e}")
+                citations = []
+            self._count(1, len(citations), time.perf_counter() - started)
+            yield citations
+
+    def _count(self, texts, citations, seconds, skipped=0):
+        with self._stats_lock:
+            self.texts_processed += texts
+            self.texts_skipped += skipped
+            self.citations_found += citations
+            self.seconds += seconds
+
+    def stats(self):
+        """Throughput of the NER step so far; time spent by callers between results is excluded."""
+        with self._stats_lock:
+            return {
+                'texts': self.texts_processed,
+                'skipped_by_prefilter': self.texts_skipped,
+                'citations': self.citations_found,
+                'seconds': round(self.seconds, 2),
+                'texts_per_second': round(self.texts_processed / self.seconds, 1) if self.seconds else 0.0
+            }
+
+
+def init_ner_worker():
+    """
+    Process-pool initializer for extract_citations: one torch thread per
+    worker, so a pool of N processes does not run N x N threads.
+    """
+    torch.set_num_threads(1)
+
+
+def extract_citations(texts):
+    """
+    Process-pool entry point: the citations of each text, in order, and the
+    seconds spent on them. The pipeline is loaded once per process.
+    """
+    from models.registry import get_citation_pipeline
+    started = time.perf_counter()
+    citations = list(get_citation_pipeline().process_batch(texts, n_process=1))
+    return citations, time.perf_counter() - started
+
+
+def measure_prefilter_recall(pipeline, related_dir="data/related", limit=None, context_chars=None):
+    """
+    Compare the prefilter against the full NER model on the commentaries in
+    `related_dir`. Text recall is the share of texts with citations that the
+    gate lets through; citation recall is the share of the model's
+    citations still found when the model only sees the gated input.
+    """
+    texts = []
+    for jsonl_file in sorted(glob.glob(os.path.join(related_dir, '*.jsonl'))):
+        with open(jsonl_file, 'r', encoding='utf-8') as file:
+            for line in file:
                 try:
-                    result = self.process_text(text)
-                    results.append(result)
-                except Exception as e:
-                    print(f"Error processing batch item: {e}")
-                    results.append([])
-            else:
-                results.append([])
-        return results
\ No newline at end of file
+                    text = json.loads(line).get('text')
+                except json.JSONDecodeError:
+                    continue
+                if text:
+                    texts.append(text)
+    if limit:
+        texts = texts[:limit]
+
+    full = list(pipeline.process_batch(texts, prefilter=False))
+    gated_inputs = [gate_text(text, context_chars) for text in texts]
+    gated = list(pipeline.process_batch(
+        [text for text in gated_inputs if text is not None], prefilter=False))
+    gated_by_text = iter(gated)
+    gated = [next(gated_by_text) if text is not None else [] for text in gated_inputs]
+
+    with_citations = [i for i, citations in enumerate(full) if citations]
+    passed = [i for i in with_citations if gated_inputs[i] is not None]
+    expected = sum(len(set(full[i])) for i in with_citations)
+    found = sum(len(set(full[i]) & set(gated[i])) for i in with_citations)
+
+    report = {
+        'texts': len(texts),
+        'skipped': sum(text is None for text in gated_inputs),
+        'texts_with_citations': len(with_citations),
+        'text_recall': len(passed) / len(with_citations) if with_citations else 1.0,
+        'citation_recall': found / expected if expected else 1.0,
+        'context_chars': context_chars
+    }
+    print(f"Prefilter recall: {report}")
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Measure the recall of the citation prefilter against the full NER model')
+    parser.add_argument('--related-dir', default='data/related')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='Only use the first N texts')
+    parser.add_argument('--context-chars', type=int, default=None,
+                        help='Also measure sending only this much text around candidates')
+    args = parser.parse_args()
+
+    measure_prefilter_recall(LegalCitationPipeline(), args.related_dir,
+                             args.limit, args.context_chars)
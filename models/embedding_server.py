@@ -0,0 +1,257 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Texts per model call when coalescing requests
+SERVER_MAX_BATCH = 64
+# How long the first request of a batch waits for others to join it
+SERVER_MAX_WAIT = 0.01
+# Texts per HTTP request sent by the client
+CLIENT_REQUEST_SIZE = 256
+CLIENT_TIMEOUT = 300
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent embedding requests into model calls of up to
+    `max_batch` texts. A batch is run once it is full or `max_wait` seconds
+    after its first request arrived, whichever comes first.
+    """
+
+    def __init__(self, model, max_batch: int = SERVER_MAX_BATCH, max_wait: float = SERVER_MAX_WAIT):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        request = {'texts': texts, 'done': threading.Event(), 'result': None, 'error': None}
+        self._queue.put(request)
+        request['done'].wait()
+        if request['error'] is not None:
+            raise request['error']
+        return request['result']
+
+    def _next_batch(self):
+        pending = [self._queue.get()]
+        count = len(pending[0]['texts'])
+        deadline = time.monotonic() + self.max_wait
+        while count < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            pending.append(request)
+            count += len(request['texts'])
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._next_batch()
+            texts = [text for request in pending for text in request['texts']]
+            try:
+                vectors = self.model.get_embeddings(texts, batch_size=self.max_batch)
+            except Exception as e:
+                for request in pending:
+                    request['error'] = e
+                    request['done'].set()
+                continue
+
+            self.requests += len(pending)
+            self.batches += 1
+            self.texts += len(texts)
+            offset = 0
+            for request in pending:
+                request['result'] = vectors[offset:offset + len(request['texts'])]
+                offset += len(request['texts'])
+                request['done'].set()
+
+    def stats(self) -> Dict:
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'texts': self.texts,
+            'texts_per_batch': self.texts / self.batches if self.batches else 0.0
+        }
+
+
+class EmbeddingService:
+    """Hosts one ModelEmbeddings per model (legal or general), loaded on first request."""
+
+    def __init__(self, backend: str = None, max_batch: int = SERVER_MAX_BATCH, max_wait: float = SERVER_MAX_WAIT):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._batchers = {}
+        self._lock = threading.Lock()
+
+    def batcher(self, legal: bool) -> MicroBatcher:
+        with self._lock:
+            if legal not in self._batchers:
+                from models.chunker import ModelEmbeddings
+                started = time.perf_counter()
+                model = ModelEmbeddings(legal=legal, backend=self.backend)
+                logger.info(f"Loaded {model.model_version} in {time.perf_counter() - started:.1f}s")
+                self._batchers[legal] = MicroBatcher(model, self.max_batch, self.max_wait)
+            return self._batchers[legal]
+
+    def info(self, legal: bool) -> Dict:
+        model = self.batcher(legal).model
+        return {
+            'model_name': model.model_name,
+            'model_version': model.model_version,
+            'backend': model.backend,
+            'embedding_size': model.embedding_size
+        }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {batcher.model.model_version: batcher.stats()
+                    for batcher in self._batchers.values()}
+
+
+def _handler(service: EmbeddingService):
+    class EmbeddingHandler(BaseHTTPRequestHandler):
+        def _reply(self, status, payload):
+            self._send(status, json.dumps(payload).encode('utf-8'), 'application/json')
+
+        def _send(self, status, body, content_type, headers=()):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            legal = parse_qs(url.query).get('legal', ['1'])[0] == '1'
+            try:
+                if url.path == '/info':
+                    self._reply(200, service.info(legal))
+                elif url.path == '/stats':
+                    self._reply(200, service.stats())
+                else:
+                    self._reply(404, {'error': f"Unknown path {url.path}"})
+            except Exception as e:
+                logger.error(f"Error serving {self.path}: {str(e)}")
+                self._reply(500, {'error': str(e)})
+
+        def do_POST(self):
+            if self.path != '/embed':
+                self._reply(404, {'error': f"Unknown path {self.path}"})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length))
+                embeddings = np.ascontiguousarray(
+                    service.batcher(bool(request.get('legal', True))).embed(request['texts']),
+                    dtype=np.float32)
+                # Vectors travel as raw float32 rows; the shape header lets the client rebuild them
+                self._send(200, embeddings.tobytes(), 'application/octet-stream',
+                           [('X-Embedding-Shape', '%d,%d' % embeddings.shape)])
+            except Exception as e:
+                logger.error(f"Error embedding request: {str(e)}")
+                self._reply(500, {'error': str(e)})
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return EmbeddingHandler
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, backend: str = None,
+          max_batch: int = SERVER_MAX_BATCH, max_wait: float = SERVER_MAX_WAIT, preload: bool = False):
+    service = EmbeddingService(backend, max_batch, max_wait)
+    if preload:
+        service.batcher(legal=True)
+    server = ThreadingHTTPServer((host, port), _handler(service))
+    logger.info(f"Embedding server listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class RemoteEmbeddings:
+    """
+    Client with the interface of ModelEmbeddings that sends texts to an
+    embedding server instead of loading the model in this process.
+    """
+
+    def __init__(self, url: str, legal: bool = True):
+        self.url = url.rstrip('/')
+        self.legal = legal
+        info = self._request(f"/info?legal={int(legal)}")
+        self.model_name = info['model_name']
+        self.model_version = info['model_version']
+        self.backend = info['backend']
+        self.embedding_size = info['embedding_size']
+        logger.info(f"Using embedding server {self.url} for {self.model_version}")
+
+    def _open(self, path: str, payload: Dict = None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        request = urllib.request.Request(
+            self.url + path, data=data, headers={'Content-Type': 'application/json'})
+        return urllib.request.urlopen(request, timeout=CLIENT_TIMEOUT)
+
+    def _request(self, path: str) -> Dict:
+        with self._open(path) as response:
+            return json.loads(response.read())
+
+    def get_embeddings(self, texts: List[str], max_length: int = 512, batch_size: int = None) -> np.ndarray:
+        embeddings = np.zeros((len(texts), self.embedding_size), dtype=np.float32)
+        for start in range(0, len(texts), CLIENT_REQUEST_SIZE):
+            batch = texts[start:start + CLIENT_REQUEST_SIZE]
+            with self._open('/embed', {'legal': self.legal, 'texts': batch}) as response:
+                rows, size = map(int, response.headers['X-Embedding-Shape'].split(','))
+                embeddings[start:start + rows] = np.frombuffer(
+                    response.read(), dtype=np.float32).reshape(rows, size)
+        return embeddings
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.get_embeddings([text])[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve embeddings to local processes')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--backend', choices=['torch', 'onnx', 'onnx-int8'],
+                        default=os.environ.get('EMBEDDING_BACKEND'))
+    parser.add_argument('--max-batch', type=int, default=SERVER_MAX_BATCH,
+                        help='Texts per model call')
+    parser.add_argument('--max-wait-ms', type=float, default=SERVER_MAX_WAIT * 1000,
+                        help='Longest a request waits for others to share its batch')
+    parser.add_argument('--preload', action='store_true',
+                        help='Load the legal model before accepting requests')
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.backend, args.max_batch,
+          args.max_wait_ms / 1000, args.preload)
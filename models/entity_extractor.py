@@ -1,7 +1,54 @@
+import os
+import re
+from typing import Dict, List, Optional
+
 from gliner import GLiNER
 
+DEFAULT_LABELS = [
+    "azienda", "organizzazione", "località", "soggetto", "ruolo", "ente giuridico", "procedura legale", "persona", "indirizzo", "data", "numero", "importo", "contratto", "oggetto", "legge"]
+
+# Labels extracted for each document type; smaller sets are cheaper to run
+LABEL_SETS = {
+    'default': DEFAULT_LABELS,
+    'contratto': ["azienda", "organizzazione", "persona", "ruolo", "indirizzo", "data", "numero", "importo", "contratto", "oggetto", "legge"],
+    'busta_paga': ["azienda", "persona", "ruolo", "indirizzo", "data", "numero", "importo"],
+    'certificato': ["persona", "località", "indirizzo", "data", "numero", "ente giuridico", "soggetto"],
+    'sentenza': ["persona", "organizzazione", "ente giuridico", "procedura legale", "soggetto", "ruolo", "data", "numero", "importo", "oggetto", "legge"],
+    'perizia': ["persona", "soggetto", "oggetto", "importo", "data", "località", "indirizzo"],
+}
+
+# Keywords in the file name that identify the document type
+DOC_TYPE_KEYWORDS = {
+    'contratto': ['contratto', 'mutuo', 'leasing', 'prestito'],
+    'busta_paga': ['busta paga'],
+    'certificato': ['certificato', 'stato di famiglia', 'atto', 'attestazione', 'visura'],
+    'sentenza': ['sentenza', 'ispezione', 'crif', 'cartelle', 'sollecito', 'creditori'],
+    'perizia': ['perizia'],
+}
+
+# GLiNER's own word splitting, used to budget words per inference window
+WORD_PATTERN = re.compile(r'\w+(?:[-_]\w+)*|\S')
+# Words per packed window; GLiNER truncates its input at 384 words
+MAX_WINDOW_WORDS = 384
+# Packed windows per GLiNER inference call
+GLINER_BATCH_SIZE = 8
+
+
+def infer_doc_type(doc_location: str) -> str:
+    name = os.path.basename(doc_location).lower()
+    for doc_type, keywords in DOC_TYPE_KEYWORDS.items():
+        if any(keyword in name for keyword in keywords):
+            return doc_type
+    return 'default'
+
+
+def labels_for(doc_type: Optional[str]) -> List[str]:
+    return LABEL_SETS.get(doc_type or 'default', DEFAULT_LABELS)
+
 
 class EntityExtractor:
+    MODEL_NAME = "DeepMount00/GLiNER_PII_ITA"
+
     _instance = None
     _model = None
 
@@ -14,10 +61,60 @@ class EntityExtractor:
     def __init__(self):
         if EntityExtractor._model is None:
             EntityExtractor._model = GLiNER.from_pretrained(
-                "DeepMount00/GLiNER_PII_ITA")
+                EntityExtractor.MODEL_NAME)
 
     def extract_entities(self, text, labels=None):
+        return self.extract_entities_batch([text], labels)[0]
+
+    def _pack(self, texts: List[str], max_words: int):
+        """
+        Greedily pack consecutive texts into windows of at most `max_words`
+        words. Returns (window_text, [(text_index, start, end)]) pairs, where
+        start/end are the character span of each text inside the window.
+        """
+        windows = []
+        parts, spans, words, length = [], [], 0, 0
+        for i, text in enumerate(texts):
+            text_words = len(WORD_PATTERN.findall(text))
+            if parts and words + text_words > max_words:
+                windows.append(('\n'.join(parts), spans))
+                parts, spans, words, length = [], [], 0, 0
+            start = length + (1 if parts else 0)
+            parts.append(text)
+            spans.append((i, start, start + len(text)))
+            words += text_words
+            length = start + len(text)
+        if parts:
+            windows.append(('\n'.join(parts), spans))
+        return windows
+
+    def extract_entities_batch(self, texts: List[str], labels=None, max_words: int = MAX_WINDOW_WORDS,
+                               batch_size: int = GLINER_BATCH_SIZE, threshold: float = 0.5) -> List[List[Dict]]:
+        """
+        Extract entities from many texts with few GLiNER calls: short texts
+        are packed into windows of up to `max_words` words, windows are run in
+        batches, and entity offsets are mapped back onto the original texts.
+        Entities spanning two packed texts are dropped.
+        """
         if labels is None:
-            labels = [
-                "azienda", "organizzazione", "località", "soggetto", "ruolo", "ente giuridico", "procedura legale", "persona", "indirizzo", "data", "numero", "importo", "contratto", "oggetto", "legge"]
-        return EntityExtractor._model.predict_entities(text, labels)
+            labels = DEFAULT_LABELS
+
+        results = [[] for _ in texts]
+        windows = self._pack(texts, max_words)
+        model = EntityExtractor._model
+        predict = getattr(model, 'batch_predict_entities', None) or model.inference
+
+        for start in range(0, len(windows), batch_size):
+            batch = windows[start:start + batch_size]
+            predictions = predict([window for window, _ in batch], labels, threshold=threshold)
+
+            for (_, spans), entities in zip(batch, predictions):
+                for entity in entities:
+                    for i, span_start, span_end in spans:
+                        if span_start <= entity['start'] and entity['end'] <= span_end:
+                            results[i].append(dict(
+                                entity,
+                                start=entity['start'] - span_start,
+                                end=entity['end'] - span_start))
+                            break
+        return results
@@ -1,15 +1,24 @@
 from typing import Optional, List, Dict
-from neo4j import GraphDatabase
-from chunker import Embedder
+from neo4j_package.bulk import vector_param
+from neo4j_package.driver import get_session
+from models.registry import get_embedder
 
 class GraphSearcher:
-    def __init__(self, uri: str, user: str, password: str):
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
-        self.embeddings = Embedder()
-        self.legal_embeddings = Embedder(legal=True)
+    def __init__(self, neo4j_config: Dict, embedding_backend: Optional[str] = None):
+        self.neo4j_config = neo4j_config
+        self.embedding_backend = embedding_backend
+
+    # Embedding models are loaded on the first embedding search
+    @property
+    def embeddings(self):
+        return get_embedder(legal=True, backend=self.embedding_backend)
+
+    @property
+    def legal_embeddings(self):
+        return get_embedder(legal=True, backend=self.embedding_backend)
 
     def search_by_embedding(self, doc_name: Optional[str], query: str, limit: int) -> List[Dict]:
-        embedding = self.embeddings.get_embedding(query)
+        embedding = vector_param(self.embeddings.get_embedding(query))
 
         if doc_name:
             cypher_query = """
@@ -166,7 +175,7 @@ class GraphSearcher:
 
     def _execute_single_doc_query(self, cypher_query: str, params: Dict) -> List[Dict]:
         results = []
-        with self.driver.session() as session:
+        with get_session(self.neo4j_config) as session:
             raw_results = list(session.run(cypher_query, params))
 
             for record in raw_results:
@@ -197,7 +206,7 @@ class GraphSearcher:
 
     def _execute_query(self, cypher_query: str, params: Dict) -> List[Dict]:
         results = []
-        with self.driver.session() as session:
+        with get_session(self.neo4j_config) as session:
             raw_results = list(session.run(cypher_query, params))
 
             for record in raw_results:
@@ -254,7 +263,7 @@ class GraphSearcher:
             "article_title": article_title,
             "law_name": law_name
         }
-        with self.driver.session() as session:
+        with get_session(self.neo4j_config) as session:
             result = session.run(cypher_query, params).single()
             if result:
                 return [{
@@ -273,13 +282,13 @@ class GraphSearcher:
         2. Direct embedding search among leaf nodes
         3. Direct text search among leaf nodes
         """
-        query_embedding = self.legal_embeddings.get_embedding(query)
+        query_embedding = vector_param(self.legal_embeddings.get_embedding(query))
         
         results = []
         visited = set()
         queue = []
 
-        with self.driver.session() as session:
+        with get_session(self.neo4j_config) as session:
             start_query = """
             MATCH (d:Document)
             WHERE CASE 
@@ -401,6 +410,7 @@ class GraphSearcher:
 
 
     def close(self):
-        self.driver.close()
+        # The driver is shared through neo4j_package.driver and closed at exit
+        pass
 
 
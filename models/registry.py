@@ -0,0 +1,66 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Models are imported inside the getters so importing this module stays cheap
+_models = {}
+_load_times = {}
+_lock = threading.RLock()
+
+
+def get_model(key, factory: Callable):
+    """
+    Return the process-wide instance stored under `key`, building it with
+    `factory()` on first use and logging how long the load took.
+    """
+    with _lock:
+        if key not in _models:
+            started = time.perf_counter()
+            _models[key] = factory()
+            _load_times[key] = time.perf_counter() - started
+            logger.info(f"Loaded {key} in {_load_times[key]:.1f}s")
+        return _models[key]
+
+
+def loaded_models() -> Dict:
+    """Load time in seconds of every model loaded so far, by key."""
+    with _lock:
+        return dict(_load_times)
+
+
+def configure(config: Dict):
+    """
+    Apply model settings from config.yaml. EMBEDDING_BACKEND and
+    EMBEDDING_SERVER_URL, when set, win over the config.
+    """
+    if config.get('embedding_backend'):
+        os.environ.setdefault('EMBEDDING_BACKEND', config['embedding_backend'])
+    if config.get('embedding_server'):
+        os.environ.setdefault('EMBEDDING_SERVER_URL', config['embedding_server'])
+
+
+def get_embedder(legal: bool = True, backend: Optional[str] = None):
+    from models.chunker import Embedder, resolve_backend
+    backend = resolve_backend(backend)
+    return get_model(('embedder', legal, backend),
+                     lambda: Embedder(legal=legal, backend=backend))
+
+
+def get_entity_extractor():
+    from models.entity_extractor import EntityExtractor
+    return get_model('entity_extractor', EntityExtractor.get_instance)
+
+
+def get_chunker():
+    from models.chunker import Chunker
+    return get_model('chunker', Chunker.get_instance)
+
+
+def get_citation_pipeline():
+    from models.citation_extractor import LegalCitationPipeline
+    return get_model('citation_pipeline', LegalCitationPipeline)
@@ -1,92 +1,276 @@
-from neo4j import GraphDatabase
+import difflib
 import logging
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from neo4j_package.bulk import DEFAULT_BATCH_SIZE, run_unwind
+from neo4j_package.driver import get_session
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Minimum difflib ratio between the words of a cited law name and of a KB name
+# it does not equal; act numbers and years must always match exactly
+FUZZY_CUTOFF = 0.85
+
+# Common ways laws in the KB are cited, by the normalized KB name they refer to.
+# Aliases of laws that are not loaded are ignored.
+ALIASES = {
+    'codice civile': ['c.c.', 'cod. civ.', 'cod. civile', 'r.d. 262/1942'],
+    'codice di procedura civile': ['c.p.c.', 'cod. proc. civ.', 'codice procedura civile', 'r.d. 1443/1940'],
+    'testo unico delle imposte sui redditi': ['TUIR', 'T.U.I.R.', 'd.p.r. 917/1986'],
+    'testo unico delle leggi in materia bancaria e creditizia': [
+        'TUB', 'T.U.B.', 'testo unico bancario', 'd.lgs. 385/1993'],
+    'testo unico delle disposizioni in materia di intermediazione finanziaria': [
+        'TUF', 'T.U.F.', 'testo unico della finanza', 'd.lgs. 58/1998'],
+    'codice del consumo': ['cod. cons.', 'd.lgs. 206/2005'],
+    'codice delle assicurazioni private': ['cod. ass.', 'codice delle assicurazioni', 'd.lgs. 209/2005'],
+    'codice della proprieta industriale': ['c.p.i.', 'd.lgs. 30/2005'],
+    "codice della crisi d'impresa e dell'insolvenza": [
+        'CCII', 'c.c.i.i.', "codice della crisi d'impresa", 'd.lgs. 14/2019'],
+    'nuovo codice della strada': ['c.d.s.', 'codice della strada', 'd.lgs. 285/1992'],
+    'codice in materia di protezione dei dati personali': [
+        'codice della privacy', 'codice privacy', 'd.lgs. 196/2003'],
+    'codice dei contratti pubblici': ['codice degli appalti', 'd.lgs. 36/2023'],
+    'codice dei beni culturali e del paesaggio': ['codice dei beni culturali', 'd.lgs. 42/2004'],
+    'disposizioni sul processo tributario': ['codice del processo tributario', 'd.lgs. 546/1992'],
+    'disciplina della responsabilita amministrativa delle persone giuridiche delle societa e delle '
+    'associazioni anche prive di personalita giuridica': ['d.lgs. 231/2001'],
+}
+
+# Spelled-out act types, rewritten to the abbreviation used in citations
+ACT_TYPES = [
+    (re.compile(r'\bdecreto legislativo\b'), 'd lgs'),
+    (re.compile(r'\bdlgs\b'), 'd lgs'),
+    (re.compile(r'\bdecreto legge\b'), 'd l'),
+    (re.compile(r'\bdecreto del presidente della repubblica\b'), 'd p r'),
+    (re.compile(r'\bdpr\b'), 'd p r'),
+    (re.compile(r'\blegge\b'), 'l'),
+]
+# "LEGGE 7 agosto 1990 , n. 241" -> act type, year and number
+DATED_ACT = re.compile(r'^(?P<act>[a-z ]+?) \d{1,2} [a-z]+ (?P<year>\d{4}) n (?P<number>\d+)\b')
+NUMBERED_ACT = re.compile(r'\b(?:n )?(?P<number>\d+) (?:del )?(?P<year>\d{4})\b')
+
+ARTICLE_SUFFIXES = ('bis', 'ter', 'quater', 'quinquies', 'sexies', 'septies',
+                    'octies', 'novies', 'nonies', 'decies', 'undecies', 'duodecies')
+ARTICLE_NUMBER = re.compile(
+    r'(\d+)(?:\s*[-.]?\s*(%s)\b)?' % '|'.join(sorted(ARTICLE_SUFFIXES, key=len, reverse=True)),
+    re.IGNORECASE)
+
+
+def normalize_law_name(name):
+    """Lowercase, strip accents, punctuation and spelled-out act types: 'D.Lgs. n. 385 del 1993' -> 'd lgs 385 1993'."""
+    name = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode('ascii').lower()
+    name = re.sub(r"[^a-z0-9']+", ' ', name).strip()
+    for pattern, abbreviation in ACT_TYPES:
+        name = pattern.sub(abbreviation, name)
+    return NUMBERED_ACT.sub(r'\g<number> \g<year>', name)
+
+
+def normalize_article_number(article):
+    """'Art. 2043 bis', 'art. 2043-bis' and '2043bis' all become '2043-bis'; None if there is no number."""
+    match = ARTICLE_NUMBER.search(str(article or ''))
+    if not match:
+        return None
+    number, suffix = match.groups()
+    return f"{number}-{suffix.lower()}" if suffix else number
+
+
+def _article_titles(number):
+    """Titles an article node numbered `number` ('2043' or '2043-bis') may carry."""
+    spellings = {number, number.replace('-', ' '), number.replace('-', '')}
+    return [f"{prefix} {spelling}" for prefix in ('Art.', 'Articolo') for spelling in sorted(spellings)]
+
+
+def _split_name(name):
+    """Split a normalized law name into its words and its number and year tokens."""
+    tokens = name.split()
+    words = ' '.join(token for token in tokens if not token.isdigit())
+    numbers = tuple(token for token in tokens if token.isdigit())
+    return words, numbers
+
+
+def _name_variants(nome_legge):
+    """Normalized names a KB document answers to besides its aliases."""
+    full = normalize_law_name(nome_legge)
+    variants = {full}
+    # Parenthesised parts are either acronyms, kept as aliases, or dates
+    for part in re.findall(r'\(([^)]*)\)', nome_legge):
+        if not re.search(r'\d', part):
+            variants.add(normalize_law_name(part))
+    bare = normalize_law_name(re.sub(r'\([^)]*\)', ' ', nome_legge))
+    variants.add(bare)
+    dated = DATED_ACT.match(bare)
+    if dated:
+        variants.add(f"{dated['act']} {dated['number']} {dated['year']}")
+    return variants
+
+
 class ArticleMatcher:
+    """
+    Resolves (law name, article number) citations to KB article nodes from an
+    in-memory index of the graph, loaded on first use. Law names are matched
+    by normalized name, then ALIASES, then fuzzily with difflib; articles by
+    number with their bis/ter suffix. Call `refresh` after the KB changes.
+    """
+
     def __init__(self, neo4j_config):
-        self.driver = GraphDatabase.driver(
-            neo4j_config['url'],
-            database=neo4j_config['database'],
-            auth=(neo4j_config['user'], neo4j_config['password'])
-        )
+        self.neo4j_config = neo4j_config
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._documents = {}
+        self._fuzzy_names = {}
+        self._articles = {}
+        self._resolved_names = {}
 
     def close(self):
-        self.driver.close()
+        # The driver is shared through neo4j_package.driver and closed at exit
+        pass
 
-    def find_best_match(self, doc_name, article_number):
-        try:
-            with self.driver.session() as session:
-                escaped_name = doc_name.replace('"', '\\"').strip()
-                query_string = f'"{escaped_name}"'
-
-                query = """
-                    CALL db.index.fulltext.queryNodes('documentName', $query_str) 
-                    YIELD node, score
-                    WHERE node:Document 
-                    AND node.nome_legge IS NOT NULL
-                    AND score > 0.8  // Strict score threshold
-                    RETURN node.nome_legge AS nome_legge, 
-                        node.elementId AS document_id,
-                        score
-                    ORDER BY score DESC
-                    LIMIT 1
-                """
-                
-                result = session.run(query, query_str=query_string)
-                record = result.single()
-
-                if not record:
-                    logger.info(f"No strong match found for document: {doc_name} (threshold not met)")
-                    return None, None
-
-                document_name = record["nome_legge"]
-                document_id = record["document_id"]
-                match_score = record["score"]
-                
-                logger.info(f"""
-                    Match found:
-                    Original: {doc_name}
-                    Matched: {document_name}
-                    Score: {match_score}
+    def refresh(self):
+        """Reload the index from the graph."""
+        documents = {}
+        articles = {}
+        with get_session(self.neo4j_config) as session:
+            result = session.run("""
+                MATCH (d:Document)
+                WHERE d.nome_legge IS NOT NULL
+                RETURN elementId(d) AS document_id, d.nome_legge AS nome_legge
+                """)
+            names = {record['document_id']: record['nome_legge'] for record in result}
+
+            result = session.run("""
+                MATCH (d:Document)-[:HAS*]->(a:contenuto)
+                WHERE d.nome_legge IS NOT NULL
+                AND (a.titolo STARTS WITH 'Art' OR a.titolo STARTS WITH 'art')
+                RETURN elementId(d) AS document_id, a.titolo AS titolo, elementId(a) AS article_id
                 """)
+            for record in result:
+                number = normalize_article_number(record['titolo'])
+                if number:
+                    articles.setdefault((record['document_id'], number), record['article_id'])
+
+        # Several KB files can carry the same nome_legge; the first one loaded wins
+        for document_id, nome_legge in names.items():
+            for variant in _name_variants(nome_legge):
+                documents.setdefault(variant, document_id)
+        for name, aliases in ALIASES.items():
+            document_id = documents.get(normalize_law_name(name))
+            if document_id is None:
+                continue
+            for alias in aliases:
+                documents.setdefault(normalize_law_name(alias), document_id)
+
+        # Fuzzy candidates are grouped by their numbers, so "d.lgs. 24/2019"
+        # can never match d.lgs. 14/2019 however close the words are
+        fuzzy_names = defaultdict(dict)
+        for name, document_id in documents.items():
+            words, numbers = _split_name(name)
+            fuzzy_names[numbers].setdefault(words, document_id)
+
+        self._documents = documents
+        self._fuzzy_names = dict(fuzzy_names)
+        self._articles = articles
+        self._resolved_names = {}
+        self._loaded = True
+        logger.info(f"Article index loaded: {len(names)} laws, {len(documents)} names, {len(articles)} articles")
 
-                # Only proceed if we have a very strong match
-                if match_score > 0.8:
-                    # Find the exact matching article
-                    article_query = """
-                        MATCH (d:Document {elementId: $doc_id})-[:HAS*]->(a:contenuto)
-                        WHERE a.titolo = 'Art. ' + $art_num
-                        OR a.titolo = 'Articolo ' + $art_num
-                        RETURN a.elementId AS article_id
-                        LIMIT 1
-                    """
-                    article_result = session.run(article_query, 
-                                            doc_id=document_id,
-                                            art_num=str(article_number))
-                    
-                    article = article_result.single()
-
-                    if article:
-                        logger.info(f"Found matching article: {article['article_id']}")
-                        return document_id, article["article_id"]
-                    
-                    logger.info(f"No matching article found for number: {article_number}")
-                    return document_id, None
-                
-                logger.info(f"Match score too low: {match_score}")
-                return None, None
-
-        except Exception as e:
-            logger.error(f"Error in find_best_match: {str(e)}")
-            return None, None
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.refresh()
 
+    def resolve_document(self, doc_name):
+        """Element id of the KB document `doc_name` refers to, or None."""
+        self._ensure_loaded()
+        document_id = self._resolved_names.get(doc_name, False)
+        if document_id is not False:
+            return document_id
 
+        name = normalize_law_name(doc_name)
+        document_id = self._documents.get(name)
+        if document_id is None and name:
+            words, numbers = _split_name(name)
+            candidates = self._fuzzy_names.get(numbers, {})
+            close = difflib.get_close_matches(words, candidates, n=1, cutoff=FUZZY_CUTOFF)
+            if close:
+                logger.debug(f"Fuzzy match: {doc_name} -> {close[0]} {' '.join(numbers)}")
+                document_id = candidates[close[0]]
+        self._resolved_names[doc_name] = document_id
+        return document_id
+
+    def find_best_match(self, doc_name, article_number):
+        """Return (document_id, article_id) element ids; either is None when not found."""
+        return self.resolve_many([(doc_name, article_number)])[0]
+
+    def resolve_many(self, citations):
+        """
+        Resolve a list of (doc_name, article_number) pairs to (document_id,
+        article_id) element ids, in order. Pairs the index does not know are
+        looked up in the graph with a single UNWIND query and remembered,
+        including the ones that are not found. Errors reaching the graph
+        propagate, so callers can record the citations as failed.
+        """
+        keys = []
+        for doc_name, article_number in citations:
+            document_id = self.resolve_document(doc_name)
+            number = normalize_article_number(article_number)
+            if document_id is None:
+                logger.debug(f"No match found for document: {doc_name}")
+            keys.append((document_id, number) if document_id and number else None)
+
+        misses = {key for key in keys if key is not None and key not in self._articles}
+        if misses:
+            self._lookup_articles(misses)
+
+        resolved = []
+        for key in keys:
+            if key is None:
+                resolved.append((None, None))
+                continue
+            article_id = self._articles.get(key)
+            if article_id is None:
+                logger.debug(f"No matching article found for number: {key[1]}")
+            resolved.append((key[0], article_id))
+        return resolved
+
+    def _lookup_articles(self, keys):
+        rows = [{'document_id': document_id, 'number': number, 'titles': _article_titles(number)}
+                for document_id, number in keys]
+        with get_session(self.neo4j_config) as session:
+            result = session.run("""
+                UNWIND $rows AS row
+                MATCH (d:Document) WHERE elementId(d) = row.document_id
+                MATCH (d)-[:HAS*]->(a:contenuto)
+                WHERE a.titolo IN row.titles
+                RETURN row.document_id AS document_id, row.number AS number,
+                    collect(elementId(a))[0] AS article_id
+                """, rows=rows)
+            found = {(record['document_id'], record['number']): record['article_id'] for record in result}
+        for key in keys:
+            self._articles[key] = found.get(key)
 
     def create_related_relationship(self, source_id, target_id):
-        with self.driver.session() as session:
-            session.run("""
-                MATCH (source:contenuto {id: $source_id})
-                MATCH (target:contenuto {id: $target_id})
-                MERGE (source)-[:RELATED]->(target)
-            """, source_id=source_id, target_id=target_id)
+        self.create_related_many([(source_id, target_id)])
+
+    def create_related_many(self, edges, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        MERGE a RELATED edge for every (source_id, target_id) pair of element
+        ids, batch_size edges per UNWIND, in one transaction. Returns the
+        number of pairs sent.
+        """
+        rows = [{'source_id': source_id, 'target_id': target_id}
+                for source_id, target_id in dict.fromkeys(edges)]
+        if not rows:
+            return 0
+        with get_session(self.neo4j_config) as session:
+            with session.begin_transaction() as tx:
+                sent = run_unwind(tx, """
+                    UNWIND $rows AS row
+                    MATCH (source) WHERE elementId(source) = row.source_id
+                    MATCH (target) WHERE elementId(target) = row.target_id
+                    MERGE (source)-[:RELATED]->(target)
+                    """, rows, batch_size)
+                tx.commit()
+        return sent
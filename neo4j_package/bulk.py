@@ -0,0 +1,43 @@
+import logging
+from typing import Iterable, Iterator, List
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def batched(items: Iterable, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List]:
+    """Yield successive lists of at most `batch_size` items."""
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be positive, got {batch_size}")
+
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run_unwind(tx, query: str, rows: Iterable[dict], batch_size: int = DEFAULT_BATCH_SIZE, **params) -> int:
+    """
+    Run an `UNWIND $rows AS row ...` query over `rows` in batches inside `tx`.
+    Extra keyword arguments are passed as query parameters to every batch.
+    Returns the number of rows sent.
+    """
+    sent = 0
+    for batch in batched(rows, batch_size):
+        tx.run(query, rows=batch, **params).consume()
+        sent += len(batch)
+    return sent
+
+
+def vector_param(vector) -> List[float]:
+    """
+    Convert an embedding (a float32 NumPy row or a list) to the list of
+    floats the driver sends. Embeddings stay arrays until they are written.
+    """
+    return vector.tolist() if hasattr(vector, 'tolist') else list(vector)
@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+import threading
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = "data/checkpoints"
+
+
+class Checkpoint:
+    """
+    Durable progress of a long-running job, kept as a small JSON file and
+    rewritten atomically so a crash never leaves it half-written. Besides
+    free-form keys it tracks completed items and failed items with their
+    error, so a run can be resumed or only its failures retried. The
+    *_many methods update any number of items with a single write.
+    """
+
+    def __init__(self, job, resume=True, directory=CHECKPOINT_DIR):
+        self.job = job
+        self.path = os.path.join(directory, f"{job}.json")
+        self._lock = threading.RLock()
+        self.state = {}
+        # Completed items, kept as a set and saved to the 'done' list
+        self._done = set()
+        if resume:
+            self.state = self._load()
+            self._done = set(self.state.get('done', []))
+        else:
+            self.clear()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                state = json.load(file)
+            logger.info(f"Resuming {self.job} from checkpoint {self.path}")
+            return state
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint {self.path}: {str(e)}")
+            return {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self.state.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self.state[key] = value
+            self.save()
+
+    def save(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            if self._done:
+                self.state['done'] = list(self._done)
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(self.state, file, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        with self._lock:
+            self.state = {}
+            self._done = set()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def is_done(self, item):
+        with self._lock:
+            return item in self._done
+
+    def mark_done(self, item):
+        self.mark_done_many([item])
+
+    def mark_done_many(self, items):
+        with self._lock:
+            failed = self.state.get('failed', {})
+            for item in items:
+                self._done.add(item)
+                failed.pop(item, None)
+            self.save()
+
+    def record_failure(self, item, error):
+        self.record_failures([item], error)
+
+    def record_failures(self, items, error):
+        items = list(items)
+        if not items:
+            return
+        with self._lock:
+            failed = self.state.setdefault('failed', {})
+            for item in items:
+                failed[item] = str(error)
+            self.save()
+        if len(items) == 1:
+            logger.error(f"{self.job}: failed on {items[0]}: {str(error)}")
+        else:
+            logger.error(f"{self.job}: failed on {len(items)} items from {items[0]} to {items[-1]}: {str(error)}")
+
+    @property
+    def failures(self):
+        with self._lock:
+            return dict(self.state.get('failed', {}))
+
+    def finish(self, processed):
+        """
+        Log a summary of the run. A clean run removes the checkpoint; failed
+        items are kept so they can be retried on their own.
+        """
+        failures = self.failures
+        logger.info(
+            f"{self.job} finished: {processed} processed, {len(failures)} failed.")
+        if not failures:
+            self.clear()
+            return
+        for item, error in failures.items():
+            logger.info(f"  failed: {item}: {error}")
+        logger.info(f"Re-run {self.job} with --retry-failed to process only these items.")
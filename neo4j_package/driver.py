@@ -0,0 +1,66 @@
+import atexit
+import logging
+import os
+import threading
+
+from neo4j import GraphDatabase
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Pool defaults, overridable per neo4j_config
+DEFAULT_POOL_SIZE = 50
+DEFAULT_CONNECTION_LIFETIME = 3600
+DEFAULT_FETCH_SIZE = 1000
+
+_drivers = {}
+_lock = threading.Lock()
+
+
+def _driver_key(neo4j_config):
+    # Drivers must not be shared across fork(), so the pid is part of the key
+    return (os.getpid(), neo4j_config['url'], neo4j_config['user'])
+
+
+def get_driver(neo4j_config):
+    """
+    Return the process-wide pooled driver for `neo4j_config`, creating it
+    on first use. Callers must not close it; see `close_drivers`.
+    """
+    key = _driver_key(neo4j_config)
+    with _lock:
+        driver = _drivers.get(key)
+        if driver is None:
+            driver = GraphDatabase.driver(
+                neo4j_config['url'],
+                auth=(neo4j_config['user'], neo4j_config['password']),
+                max_connection_pool_size=neo4j_config.get(
+                    'max_connection_pool_size', DEFAULT_POOL_SIZE),
+                max_connection_lifetime=neo4j_config.get(
+                    'max_connection_lifetime', DEFAULT_CONNECTION_LIFETIME)
+            )
+            _drivers[key] = driver
+            logger.info(f"Created Neo4j driver for {neo4j_config['url']}")
+    return driver
+
+
+def get_session(neo4j_config, **session_config):
+    """Open a session on the shared driver with the configured database and fetch size."""
+    session_config.setdefault('database', neo4j_config.get('database'))
+    session_config.setdefault(
+        'fetch_size', neo4j_config.get('fetch_size', DEFAULT_FETCH_SIZE))
+    return get_driver(neo4j_config).session(**session_config)
+
+
+def close_drivers():
+    """Close every driver opened by this process."""
+    with _lock:
+        pid = os.getpid()
+        for key in [k for k in _drivers if k[0] == pid]:
+            try:
+                _drivers.pop(key).close()
+            except Exception as e:
+                logger.error(f"Error closing Neo4j driver: {str(e)}")
+
+
+atexit.register(close_drivers)
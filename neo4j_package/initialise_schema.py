@@ -1,4 +1,4 @@
-from neo4j import GraphDatabase
+from neo4j_package.driver import get_driver, get_session
 
 
 def initialise_schema(neo4j_config):
@@ -6,10 +6,11 @@ def initialise_schema(neo4j_config):
         # Drop existing indexes if they exist
         "DROP INDEX chunkVectorIndex",
         "DROP INDEX document_nome_legge",
-        "DROP INDEX chunk_text"
+        "DROP INDEX chunk_text",
+        # Chunk texts repeat (headers, legal formulae), so they are indexed, not unique
+        "DROP CONSTRAINT chunk_text_unique IF EXISTS",
 
         # Create constraints
-        "CREATE CONSTRAINT chunk_text_unique IF NOT EXISTS FOR (c:Chunk) REQUIRE c.text IS UNIQUE",
         "CREATE CONSTRAINT document_name_unique IF NOT EXISTS FOR (d:Document) REQUIRE d.name IS UNIQUE",
 
         # Create vector indexes
@@ -18,15 +19,21 @@ def initialise_schema(neo4j_config):
         "CREATE TEXT INDEX document_nome_legge_index FOR (d:Document) ON EACH [d.nome_legge]",
         "CREATE TEXT INDEX contenuto_titolo_index FOR (c:contenuto) ON EACH [c.titolo]",
         "CREATE INDEX chunk_text_idx IF NOT EXISTS FOR (n:Chunk) ON (n.text)",
-        "CREATE INDEX contenuto_contenuto_index IF NOT EXISTS FOR (n:contenuto) ON (n.contenuto)"
+        "CREATE INDEX contenuto_contenuto_index IF NOT EXISTS FOR (n:contenuto) ON (n.contenuto)",
+
+        # Lookup indexes used by the batched UNWIND writes
+        "CREATE INDEX chunk_chunk_id_index IF NOT EXISTS FOR (c:Chunk) ON (c.chunk_id)",
+        "CREATE INDEX entity_text_label_index IF NOT EXISTS FOR (e:Entity) ON (e.text, e.label)",
+        "CREATE INDEX ingest_record_index IF NOT EXISTS FOR (r:IngestRecord) ON (r.kind, r.source)",
+        "CREATE INDEX document_nome_legge_lookup IF NOT EXISTS FOR (d:Document) ON (d.nome_legge)",
+        "CREATE INDEX contenuto_kb_id_index IF NOT EXISTS FOR (n:contenuto) ON (n.kb_id)",
+        "CREATE INDEX parti_kb_id_index IF NOT EXISTS FOR (n:parti) ON (n.kb_id)",
+        "CREATE INDEX libri_kb_id_index IF NOT EXISTS FOR (n:libri) ON (n.kb_id)",
+        "CREATE INDEX articoli_kb_id_index IF NOT EXISTS FOR (n:articoli) ON (n.kb_id)"
     ]
 
-    driver = GraphDatabase.driver(
-        neo4j_config['url'],
-        auth=(neo4j_config['user'], neo4j_config['password'])
-    )
-    driver.verify_connectivity()
-    with driver.session() as session:
+    get_driver(neo4j_config).verify_connectivity()
+    with get_session(neo4j_config) as session:
         for cypher in cypher_schema:
             try:
                 session.run(cypher)
@@ -35,6 +42,5 @@ def initialise_schema(neo4j_config):
                 print(f"Error executing: {cypher}")
                 print(f"Error message: {str(e)}")
 
-    driver.close()
     print("Neo4j schema initialization completed.")
 
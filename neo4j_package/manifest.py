@@ -0,0 +1,62 @@
+import hashlib
+import json
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def file_hash(path, block_size=1 << 20):
+    """SHA-256 of a file's bytes, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def settings_fingerprint(settings):
+    """Stable hash of the model versions and chunker settings used to ingest a file."""
+    encoded = json.dumps(settings, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def load_manifest(session, kind):
+    """Return {source: {'content_hash', 'fingerprint'}} for every recorded file of `kind`."""
+    result = session.run("""
+        MATCH (r:IngestRecord {kind: $kind})
+        RETURN r.source AS source, r.content_hash AS content_hash, r.fingerprint AS fingerprint
+        """, kind=kind)
+    return {
+        record['source']: {
+            'content_hash': record['content_hash'],
+            'fingerprint': record['fingerprint']
+        }
+        for record in result
+    }
+
+
+def is_current(entry, content_hash, fingerprint):
+    return (entry is not None
+            and entry['content_hash'] == content_hash
+            and entry['fingerprint'] == fingerprint)
+
+
+def record_ingest(tx, kind, source, content_hash, settings):
+    """
+    Upsert the manifest entry for `source`. Meant to run in the same
+    transaction that writes the file's nodes, so both commit together.
+    """
+    tx.run("""
+        MERGE (r:IngestRecord {kind: $kind, source: $source})
+        SET r.content_hash = $content_hash,
+            r.fingerprint = $fingerprint,
+            r.settings = $settings,
+            r.ingested_at = datetime()
+        """,
+        kind=kind,
+        source=source,
+        content_hash=content_hash,
+        fingerprint=settings_fingerprint(settings),
+        settings=json.dumps(settings, sort_keys=True, ensure_ascii=False)
+    ).consume()